@@ -3,9 +3,18 @@ import unittest
 class AllTestSuite(unittest.TestSuite):
     all_tests = [
         "test_misc",
+        "test_hotkey",
         "test_xhotkeyslib",
         "test_xhotkeys_server",
         "test_gui_main",
+        "test_launcher",
+        "test_supervisor",
+        "test_control",
+        "test_latency",
+        "test_executor",
+        "test_asyncioloop",
+        "test_glibloop",
+        "test_startup",
     ]
     def __init__(self):
         unittest.TestSuite.__init__(self)
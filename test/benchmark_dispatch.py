@@ -0,0 +1,288 @@
+#!/usr/bin/python2
+"""
+Dispatch benchmark for XhotkeysServer on a headless X server.
+
+A Xvfb server is started, the xhotkeys server grabs N key bindings and key
+events are injected from another connection with the XTEST extension. Run
+it directly, results are written in JSON to track regressions:
+
+$ PYTHONPATH=. python test/benchmark_dispatch.py --bindings 10,100,1000,10000
+$ PYTHONPATH=. python test/benchmark_dispatch.py --output results.json
+
+For each number of bindings it reports the grab setup time, the dispatch
+latency percentiles at the given rate (from the injection to the callback),
+the maximum sustained rate (events injected as fast as possible) and the
+dropped (never dispatched) and misrouted (wrong callback) events.
+
+With --dispatcher, only XhotkeysServer.dispatch_event is measured (no X
+server is needed): prebuilt Xlib key events are dispatched in a loop and
+the rate (events per second) is reported for matched and unmatched events:
+
+$ PYTHONPATH=. python test/benchmark_dispatch.py --dispatcher
+"""
+import os
+import sys
+import time
+import json
+import optparse
+import threading
+import subprocess
+import collections
+
+import Xlib.X
+import Xlib.display
+import Xlib.protocol.event
+
+import xhotkeys
+from xhotkeys import server as xhserver
+from xhotkeys.latency import RollingHistogram
+
+BINDINGS = [10, 100, 1000, 10000]
+EVENTS = 1000
+DISPATCHER_EVENTS = 200000
+RATE = 200
+# Time (in seconds) to wait for events after the last injection
+DRAIN_TIMEOUT = 2.0
+# Modifiers used for bindings (no modifiers first, those are injected)
+BINDING_MASKS = [0, Xlib.X.ShiftMask, Xlib.X.ControlMask, Xlib.X.Mod1Mask,
+    Xlib.X.Mod3Mask, Xlib.X.Mod4Mask, Xlib.X.Mod5Mask]
+IGNORE_MASK = Xlib.X.LockMask | Xlib.X.Mod2Mask
+
+def start_xvfb(command="Xvfb"):
+    """Start a Xvfb server on a free display and return (popen, display_name)."""
+    fdr, fdw = os.pipe()
+    popen = subprocess.Popen([command, "-displayfd", str(fdw),
+        "-screen", "0", "640x480x16", "-nolisten", "tcp"], close_fds=False)
+    os.close(fdw)
+    try:
+        number = os.read(fdr, 64).strip()
+    finally:
+        os.close(fdr)
+    if not number:
+        popen.wait()
+        raise OSError("Xvfb failed to start (exit code %s)" % popen.returncode)
+    return popen, ":" + number
+
+def stop_xvfb(popen):
+    """Stop Xvfb server."""
+    popen.terminate()
+    popen.wait()
+
+def get_bindings(display, count):
+    """Return count pairs (keycode, mask) not using modifier keys (modifiers
+    combinations are used when there are not enough keycodes)."""
+    modifier_keycodes = set(keycode
+        for keycodes in display.get_modifier_mapping() for keycode in keycodes)
+    info = display.display.info
+    keycodes = [keycode for keycode in range(info.min_keycode, info.max_keycode + 1)
+        if keycode not in modifier_keycodes]
+    masks = [0]
+    for mask in BINDING_MASKS[1:]:
+        masks.extend([x | mask for x in masks])
+    bindings = [(keycode, mask) for mask in masks for keycode in keycodes]
+    if count > len(bindings):
+        raise ValueError("cannot create %d bindings (maximum: %d)" %
+            (count, len(bindings)))
+    return bindings[:count]
+
+class DispatchRecorder:
+    """Match injected events with the callbacks run by the server."""
+
+    def __init__(self):
+        self.pending = collections.defaultdict(collections.deque)
+        self.latencies = []
+        self.injected = 0
+        self.received = 0
+        self.misrouted = 0
+        self.last_received = None
+
+    def injected_event(self, keycode):
+        """Register an event for keycode about to be injected."""
+        self.pending[keycode].append(time.time())
+        self.injected += 1
+
+    def on_event(self, keycode):
+        """Callback for bindings."""
+        now = time.time()
+        self.received += 1
+        self.last_received = now
+        if not self.pending[keycode]:
+            self.misrouted += 1
+            return
+        self.latencies.append((now - self.pending[keycode].popleft()) * 1000.0)
+
+def inject_events(display_name, keycodes, rate, recorder):
+    """Inject a KeyPress/KeyRelease for each keycode (at rate events per
+    second, as fast as possible if None)."""
+    display = Xlib.display.Display(display_name)
+    try:
+        start = time.time()
+        for index, keycode in enumerate(keycodes):
+            if rate:
+                delay = start + float(index) / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            recorder.injected_event(keycode)
+            display.xtest_fake_input(Xlib.X.KeyPress, keycode)
+            display.xtest_fake_input(Xlib.X.KeyRelease, keycode)
+            display.flush()
+        display.sync()
+    finally:
+        display.close()
+
+def run_injection(server, display_name, keycodes, rate):
+    """Inject events while running the server. Return (recorder, elapsed)."""
+    recorder = DispatchRecorder()
+    server.set_grabs([(event_type, keycode, mask, recorder.on_event, (keycode,))
+        for (event_type, keycode, mask) in server.callbacks])
+    injector = threading.Thread(target=inject_events,
+        args=(display_name, keycodes, rate, recorder))
+    start = time.time()
+    injector.start()
+    deadline = None
+    while deadline is None or time.time() < deadline:
+        if server.process_pending_events() is None:
+            break
+        if recorder.received >= len(keycodes):
+            break
+        if deadline is None and not injector.isAlive():
+            deadline = time.time() + DRAIN_TIMEOUT
+        xhotkeys.wait_for_input([server.display], 0.05)
+    injector.join()
+    elapsed = (recorder.last_received or time.time()) - start
+    return recorder, elapsed
+
+def benchmark(display_name, nbindings, nevents=EVENTS, rate=RATE):
+    """Run the benchmark for nbindings and return the results (a dictionary)."""
+    display = Xlib.display.Display(display_name)
+    if not display.has_extension("XTEST"):
+        raise ValueError("XTEST extension not available on %s" % display_name)
+    try:
+        server = xhotkeys.XhotkeysServer(IGNORE_MASK, display=display)
+        bindings = get_bindings(display, nbindings)
+        grabs = [(Xlib.X.KeyPress, keycode, mask, lambda: None, ())
+            for (keycode, mask) in bindings]
+        start = time.time()
+        errors = server.set_grabs(grabs)
+        grab_time = time.time() - start
+        injectable = [keycode for (keycode, mask) in bindings if mask == 0]
+        keycodes = [injectable[index % len(injectable)] for index in range(nevents)]
+        recorder, elapsed = run_injection(server, display_name, keycodes, rate)
+        histogram = RollingHistogram(size=len(recorder.latencies) or 1)
+        for value in recorder.latencies:
+            histogram.add(value)
+        flood_recorder, flood_elapsed = \
+            run_injection(server, display_name, keycodes, None)
+        server.clear_grabs()
+        display.sync()
+    finally:
+        display.close()
+    return dict(bindings=nbindings,
+        grab_errors=len(filter(None, errors)),
+        grab_setup_ms=grab_time * 1000.0,
+        events=nevents, rate=rate,
+        latency_ms=histogram.get_summary(),
+        dropped=recorder.injected - recorder.received,
+        misrouted=recorder.misrouted,
+        max_rate=(flood_recorder.received / flood_elapsed if flood_elapsed else None),
+        max_rate_dropped=flood_recorder.injected - flood_recorder.received,
+        max_rate_misrouted=flood_recorder.misrouted)
+
+class NullWindow:
+    """Root window that accepts (and ignores) grab requests."""
+
+    def grab_key(self, *args, **kwargs):
+        pass
+
+    grab_button = ungrab_key = ungrab_button = grab_key
+
+class NullDisplay:
+    """Display for a server that is never connected."""
+
+    def sync(self):
+        pass
+
+    flush = sync
+
+def benchmark_dispatcher(nbindings, nevents=DISPATCHER_EVENTS):
+    """Measure the dispatch rate of XhotkeysServer.dispatch_event with
+    nbindings grabs and return the results (a dictionary)."""
+    server = xhotkeys.XhotkeysServer(IGNORE_MASK, display=NullDisplay(), 
+        root=NullWindow())
+    masks = [0]
+    for mask in BINDING_MASKS[1:]:
+        masks.extend([x | mask for x in masks])
+    bindings = [(keycode, mask) for mask in masks for keycode in range(8, 256)]
+    counter = [0]
+    def callback():
+        counter[0] += 1
+    server.set_grabs([(Xlib.X.KeyPress, keycode, mask, callback, ())
+        for (keycode, mask) in bindings[:nbindings]])
+    def key_event(keycode, state):
+        return Xlib.protocol.event.KeyPress(time=0, root=0, window=0, child=0,
+            root_x=0, root_y=0, event_x=0, event_y=0, same_screen=1,
+            state=state, detail=keycode)
+    matched = [key_event(keycode, mask | Xlib.X.LockMask)
+        for (keycode, mask) in bindings[:min(nbindings, 256)]]
+    unmatched = [key_event(keycode, Xlib.X.Button1Mask)
+        for keycode in range(8, 256)]
+    rates = {}
+    for name, events in [("matched", matched), ("unmatched", unmatched)]:
+        events = [events[index % len(events)] for index in xrange(nevents)]
+        dispatch_event = server.dispatch_event
+        start = time.time()
+        for event in events:
+            dispatch_event(event)
+        elapsed = time.time() - start
+        rates[name] = (nevents / elapsed if elapsed else None)
+    return dict(bindings=nbindings, events=nevents, callbacks=counter[0],
+        matched_rate=rates["matched"], unmatched_rate=rates["unmatched"])
+
+def run_benchmarks(display_name, bindings, nevents, rate):
+    """Run the benchmark for each number of bindings (on a new Xvfb server 
+    if display_name is None) and return the list of results."""
+    if display_name:
+        xvfb = None
+    else:
+        xvfb, display_name = start_xvfb()
+    try:
+        return [benchmark(display_name, nbindings, nevents, rate)
+            for nbindings in bindings]
+    finally:
+        if xvfb:
+            stop_xvfb(xvfb)
+
+def main(args):
+    usage = "usage: benchmark_dispatch.py [options]"
+    parser = optparse.OptionParser(usage)
+    parser.add_option('-b', '--bindings', dest='bindings',
+        default=",".join(map(str, BINDINGS)), metavar='N,...', type='string',
+        help='Comma-separated numbers of bindings')
+    parser.add_option('-e', '--events', dest='events', default=None,
+        metavar='N', type='int', help='Events injected for each run')
+    parser.add_option('-r', '--rate', dest='rate', default=RATE,
+        metavar='N', type='int', help='Injection rate for latencies (events/s)')
+    parser.add_option('-d', '--display', dest='display', default=None,
+        metavar='DISPLAY', type='string', help='Use a running X server')
+    parser.add_option('-o', '--output', dest='output', default=None,
+        metavar='FILE', type='string', help='Write results to FILE (JSON)')
+    parser.add_option('-D', '--dispatcher', dest='dispatcher', default=False,
+        action='store_true', help='Measure only the dispatcher (no X server)')
+    options, args = parser.parse_args(args)
+    bindings = [int(nbindings) for nbindings in options.bindings.split(",")]
+    if options.dispatcher:
+        results = [benchmark_dispatcher(nbindings, 
+            options.events or DISPATCHER_EVENTS) for nbindings in bindings]
+    else:
+        results = run_benchmarks(options.display, bindings, 
+            options.events or EVENTS, options.rate)
+    report = dict(version=xhserver.VERSION, python=sys.version.split()[0],
+        time=int(time.time()), results=results)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        open(options.output, "w").write(output + "\n")
+    else:
+        print output
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
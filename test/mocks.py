@@ -1,4 +1,5 @@
     #!/usr/bin/python2
+import os
 
 SCALAR, LIST = range(2)
 
@@ -61,3 +62,36 @@ class MockCallable:
                 "%s call: %s. No more responses" % (repr(self), name)
             func = fargs.pop(0)
             return func(*args, **kwargs)
+
+class MockRoot:
+    """Root window whose grab methods are mock callables."""
+    def __init__(self):
+        for name in ("grab_key", "ungrab_key", "grab_button", "ungrab_button"):
+            setattr(self, name, MockCallable())
+
+class PipeDisplay:
+    """Display whose events are written through a pipe (so it can be watched)."""
+    def __init__(self):
+        self.fdr, self.fdw = os.pipe()
+        self.events = []
+        self.flush = MockCallable()
+        self.sync = MockCallable()
+
+    def fileno(self):
+        return self.fdr
+
+    def send_event(self, event):
+        self.events.append(event)
+        os.write(self.fdw, "x")
+
+    def pending_events(self):
+        if self.events:
+            os.read(self.fdr, len(self.events))
+        return len(self.events)
+
+    def next_event(self):
+        return self.events.pop(0)
+
+    def close(self):
+        os.close(self.fdr)
+        os.close(self.fdw)
@@ -0,0 +1,82 @@
+#!/usr/bin/python2
+import unittest
+import mocks
+import Xlib.X
+import Xlib.error
+
+import xhotkeys
+from xhotkeys import asyncioloop
+from xhotkeys.asyncioloop import asyncio
+
+class XhotkeysAsyncioTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.display = mocks.PipeDisplay()
+        self.server = xhotkeys.XhotkeysServer(Xlib.X.LockMask,
+            display=self.display, root=mocks.MockRoot())
+
+    def tearDown(self):
+        self.loop.close()
+        self.display.close()
+
+    def key_event(self, keycode):
+        return mocks.Struct(type=Xlib.X.KeyPress, state=Xlib.X.ControlMask,
+            detail=keycode)
+
+    def test_serve(self):
+        calls = []
+        release = asyncio.Event(loop=self.loop)
+        @asyncio.coroutine
+        def slow_callback(value):
+            calls.append(("slow start", value))
+            yield asyncio.From(release.wait())
+            calls.append(("slow end", value))
+        def callback(value):
+            calls.append(("fast", value))
+        self.server.add_key_grab(10, Xlib.X.ControlMask, slow_callback, 1)
+        self.server.add_key_grab(11, Xlib.X.ControlMask, callback, 2)
+        future = asyncioloop.serve(self.server, self.loop)
+        self.display.send_event(self.key_event(10))
+        self.display.send_event(self.key_event(11))
+        self.loop.run_until_complete(asyncio.sleep(0.01, loop=self.loop))
+        self.assertEqual([("fast", 2), ("slow start", 1)], calls)
+        release.set()
+        self.loop.run_until_complete(asyncio.sleep(0.01, loop=self.loop))
+        self.assertEqual(("slow end", 1), calls[-1])
+        future.cancel()
+        self.loop.run_until_complete(asyncio.sleep(0, loop=self.loop))
+        self.assertEqual({}, self.server.callbacks)
+        self.assertEqual(None, self.server.executor)
+
+    def test_cancel_tasks(self):
+        cancelled = []
+        @asyncio.coroutine
+        def callback():
+            try:
+                yield asyncio.From(asyncio.sleep(10, loop=self.loop))
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        self.server.add_key_grab(10, Xlib.X.ControlMask, callback)
+        future = asyncioloop.serve(self.server, self.loop)
+        self.display.send_event(self.key_event(10))
+        self.loop.run_until_complete(asyncio.sleep(0.01, loop=self.loop))
+        future.cancel()
+        self.loop.run_until_complete(asyncio.sleep(0.01, loop=self.loop))
+        self.assertEqual([True], cancelled)
+
+    def test_connection_closed(self):
+        def pending_events():
+            raise Xlib.error.ConnectionClosedError("server")
+        self.display.pending_events = pending_events
+        future = asyncioloop.serve(self.server, self.loop)
+        self.loop.run_until_complete(asyncio.wait_for(future, 1, loop=self.loop))
+        self.assertTrue(future.done())
+        self.assertEqual(None, self.server.executor)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(XhotkeysAsyncioTest)
+
+if __name__ == '__main__':
+    unittest.main()
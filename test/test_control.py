@@ -0,0 +1,114 @@
+#!/usr/bin/python2
+import unittest
+import threading
+import tempfile
+import shutil
+import socket
+import os
+
+import xhotkeys
+from xhotkeys import control
+
+class WatchesServer:
+    """Minimal server with watches (like XhotkeysServer, without display)."""
+    def __init__(self):
+        self.watches = {}
+
+    def add_watch(self, fd, callback, *args):
+        self.watches[fd] = (callback, args)
+
+    def remove_watch(self, fd):
+        self.watches.pop(fd, None)
+
+    def run_until(self, thread):
+        while thread.isAlive():
+            for fd in xhotkeys.wait_for_input(self.watches.keys(), 0.1):
+                if fd in self.watches:
+                    callback, args = self.watches[fd]
+                    callback(*args)
+
+class XhotkeysControlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "control.socket")
+        self.server = WatchesServer()
+        def add(x, y):
+            return x + y
+        def fail():
+            raise control.ControlError("failed")
+        def crash():
+            raise IOError("read-only file system")
+        self.control_server = control.ControlServer(self.path,
+            {"add": add, "fail": fail, "crash": crash})
+        self.control_server.start(self.server)
+
+    def tearDown(self):
+        self.control_server.stop()
+        shutil.rmtree(self.directory)
+
+    def send_request(self, *args, **kwargs):
+        response = {}
+        def send():
+            try:
+                response["result"] = control.send_request(self.path, *args, **kwargs)
+            except Exception, details:
+                response["exception"] = details
+        thread = threading.Thread(target=send)
+        thread.start()
+        self.server.run_until(thread)
+        if "exception" in response:
+            raise response["exception"]
+        return response["result"]
+
+    def test_request(self):
+        self.assertEqual(3, self.send_request("add", x=1, y=2))
+        self.assertEqual("ab", self.send_request("add", x=u"a", y="b"))
+
+    def test_errors(self):
+        self.assertRaises(control.ControlError, self.send_request, "fail")
+        self.assertRaises(control.ControlError, self.send_request, "unknown")
+        self.assertRaises(control.ControlError, self.send_request, "add", x=1)
+        self.assertRaises(control.ControlError, self.send_request, "crash")
+        self.assertRaises(control.ControlError, self.send_request, "add", x=1, y="a")
+        self.assertEqual(3, self.send_request("add", x=1, y=2))
+
+    def test_reload_not_caught(self):
+        class Reload(Exception):
+            pass
+        def reload():
+            raise Reload
+        self.control_server.handlers["reload"] = reload
+        self.assertRaises(Reload, self.control_server.process_request,
+            '{"command": "reload"}')
+
+    def test_address_in_use(self):
+        # The daemon listening replies with an error to the status request
+        control_server2 = control.ControlServer(self.path, {})
+        errors = []
+        def start():
+            try:
+                control_server2.start(WatchesServer())
+            except Exception, details:
+                errors.append(details)
+        thread = threading.Thread(target=start)
+        thread.start()
+        self.server.run_until(thread)
+        self.assertEqual([socket.error], [type(error) for error in errors])
+        self.assertTrue(os.path.exists(self.path))
+        self.control_server.stop()
+        self.assertRaises(socket.error, control.send_request, self.path, "add")
+
+    def test_stale_socket(self):
+        self.control_server.socket.close()
+        self.control_server.socket = None
+        control_server2 = control.ControlServer(self.path, {})
+        control_server2.start(WatchesServer())
+        control_server2.stop()
+        self.assertFalse(os.path.exists(self.path))
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(XhotkeysControlTest)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python2
+import unittest
+import threading
+import time
+
+from xhotkeys.executor import CallbackExecutor
+
+class XhotkeysExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = CallbackExecutor(workers=4, max_pending=10)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_submit(self):
+        results = []
+        lock = threading.Lock()
+        def callback(value):
+            lock.acquire()
+            results.append(value)
+            lock.release()
+        for index in range(10):
+            self.assertTrue(self.executor.submit(callback, (index,), key=index))
+        self.assertTrue(self.executor.wait(5.0))
+        self.assertEqual(range(10), sorted(results))
+        stats = self.executor.get_stats()
+        self.assertEqual(10, stats["completed"])
+        self.assertEqual(0, stats["queued"])
+
+    def test_serialize(self):
+        running = []
+        overlaps = []
+        def slow_callback(value):
+            if running:
+                overlaps.append(value)
+            running.append(value)
+            time.sleep(0.01)
+            running.remove(value)
+        for index in range(5):
+            self.executor.submit(slow_callback, (index,))
+        self.assertTrue(self.executor.wait(5.0))
+        self.assertEqual([], overlaps)
+
+    def test_rejected(self):
+        event = threading.Event()
+        for index in range(12):
+            self.executor.submit(event.wait, (5.0,), key=index)
+        stats = self.executor.get_stats()
+        self.assertEqual(2, stats["rejected"])
+        self.assertEqual(10, stats["pending"])
+        event.set()
+        self.assertTrue(self.executor.wait(5.0))
+
+    def test_errors(self):
+        def failing_callback():
+            raise ValueError("failing")
+        self.executor.submit(failing_callback)
+        self.assertTrue(self.executor.wait(5.0))
+        self.assertEqual(1, self.executor.get_stats()["errors"])
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(XhotkeysExecutorTest)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/python2
+import unittest
+import mocks
+import gobject
+import Xlib.X
+import Xlib.error
+
+import xhotkeys
+from xhotkeys import glibloop
+
+def iterate_main_loop():
+    context = gobject.main_context_default()
+    while context.pending():
+        context.iteration(False)
+
+class XhotkeysGlibTest(unittest.TestCase):
+
+    def setUp(self):
+        self.display = mocks.PipeDisplay()
+        self.server = xhotkeys.XhotkeysServer(Xlib.X.LockMask,
+            display=self.display, root=mocks.MockRoot())
+
+    def tearDown(self):
+        self.display.close()
+
+    def key_event(self, keycode):
+        return mocks.Struct(type=Xlib.X.KeyPress, state=Xlib.X.ControlMask,
+            detail=keycode)
+
+    def test_watch(self):
+        calls = []
+        self.server.add_key_grab(10, Xlib.X.ControlMask, calls.append, 1)
+        self.server.add_key_grab(11, Xlib.X.ControlMask, calls.append, 2)
+        # queued before start: dispatched on the first idle iteration
+        self.display.send_event(self.key_event(10))
+        watch = glibloop.GlibWatch(self.server)
+        watch.start()
+        self.assertTrue(watch.running())
+        iterate_main_loop()
+        self.assertEqual([1], calls)
+        self.display.send_event(self.key_event(11))
+        self.display.send_event(self.key_event(10))
+        iterate_main_loop()
+        self.assertEqual([1, 2, 1], calls)
+        watch.stop()
+        self.assertFalse(watch.running())
+        self.display.send_event(self.key_event(11))
+        iterate_main_loop()
+        self.assertEqual([1, 2, 1], calls)
+
+    def test_connection_closed(self):
+        def pending_events():
+            raise Xlib.error.ConnectionClosedError("server")
+        self.display.pending_events = pending_events
+        watch = glibloop.GlibWatch(self.server)
+        watch.start()
+        iterate_main_loop()
+        self.assertFalse(watch.running())
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(XhotkeysGlibTest)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -38,9 +38,9 @@ class XhotkeysGUITest(unittest.TestCase):
         configfile = tempfile.NamedTemporaryFile()
         configfile.write(config_contents)
         configfile.flush()
-        pidfile = tempfile.NamedTemporaryFile()
-        pidfile.close()
-        self.gui = maingui.HotkeyListWindow(configfile.name, pidfile.name)
+        control_socket = tempfile.NamedTemporaryFile()
+        control_socket.close()
+        self.gui = maingui.HotkeyListWindow(configfile.name, control_socket.name)
         
     def test_quit_button(self):
         gtk.main_quit = mocks.MockCallable()
@@ -0,0 +1,105 @@
+#!/usr/bin/python2
+import unittest
+import tempfile
+import shutil
+import os
+
+from xhotkeys.hotkey import Hotkey
+
+config_contents = """
+    [calculator]
+        binding = <Control><Alt>1
+        command = xcalc
+        show_osd = True
+
+    [editor]
+        binding = <Control><Alt>e
+        command = gvim
+        max_instances = 2
+"""
+
+class XhotkeysHotkeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.configfile = os.path.join(self.directory, "xhotkeysrc")
+        self.snapshot = self.configfile + ".snapshot"
+        open(self.configfile, "w").write(config_contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self):
+        Hotkey.init(self.configfile, self.snapshot)
+        return dict((hotkey.name, hotkey.get_attributes()) 
+            for hotkey in Hotkey.items())
+
+    def test_items(self):
+        Hotkey.init(self.configfile)
+        calculator, editor = sorted(Hotkey.items(), key=lambda hotkey: hotkey.name)
+        self.assertEqual("calculator", calculator.name)
+        self.assertEqual(True, calculator.show_osd)
+        self.assertEqual(2, editor.max_instances)
+        self.assertFalse(os.path.exists(self.snapshot))
+
+    def test_snapshot(self):
+        items = self.load()
+        self.assertTrue(os.path.exists(self.snapshot))
+        self.assertEqual(items, self.load())
+        # loaded from the snapshot: the configuration was not parsed
+        self.assertEqual(None, Hotkey.config)
+        # same contents with a new modification time
+        os.utime(self.configfile, (0, 0))
+        self.assertEqual(items, self.load())
+        self.assertEqual(None, Hotkey.config)
+        open(self.configfile, "w").write(config_contents.replace("gvim", "emacs"))
+        self.assertEqual("emacs", self.load()["editor"]["command"])
+        self.assertEqual("emacs", self.load()["editor"]["command"])
+        open(self.snapshot, "w").write("garbage")
+        self.assertEqual("emacs", self.load()["editor"]["command"])
+
+    def test_save_from_snapshot(self):
+        self.load()
+        Hotkey.init(self.configfile, self.snapshot)
+        hotkey = [hotkey for hotkey in Hotkey.items() if hotkey.name == "editor"][0]
+        self.assertFalse(hotkey.valid(dict(hotkey.get_attributes(), 
+            name="calculator")))
+        hotkey.update(dict(name="vim", command="vim"))
+        hotkey.save()
+        self.assertEqual(["calculator", "vim"], sorted(self.load()))
+
+    def test_no_snapshot_of_unsaved_changes(self):
+        Hotkey.init(self.configfile, self.snapshot)
+        hotkey = Hotkey(None, dict(name=""))
+        hotkey.update(dict(name="unsaved", command="true"))
+        hotkey.save(write=False)
+        self.assertTrue("unsaved" in [item.name for item in Hotkey.items()])
+        self.assertFalse(os.path.exists(self.snapshot))
+        self.assertEqual(["calculator", "editor"], sorted(self.load()))
+
+    def test_get_saved_attributes(self):
+        Hotkey.init(self.configfile)
+        editor = [hotkey for hotkey in Hotkey.items() if hotkey.name == "editor"][0]
+        editor.max_instances = 3
+        self.assertEqual(2, editor.get_saved_attributes()["max_instances"])
+        editor.save(write=False)
+        self.assertEqual(3, editor.get_saved_attributes()["max_instances"])
+        self.assertEqual(None, Hotkey(None, dict(name="")).get_saved_attributes())
+
+    def test_invalid_value(self):
+        open(self.configfile, "a").write("""
+    [broken]
+        command = true
+        max_instances = two
+""")
+        Hotkey.init(self.configfile)
+        hotkeys = dict((hotkey.name, hotkey) for hotkey in Hotkey.items())
+        self.assertEqual(["broken", "calculator", "editor"], sorted(hotkeys))
+        self.assertEqual(0, hotkeys["broken"].max_instances)
+        self.assertEqual(2, hotkeys["editor"].max_instances)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(XhotkeysHotkeyTest)
+
+if __name__ == '__main__':
+    unittest.main()
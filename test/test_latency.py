@@ -0,0 +1,40 @@
+#!/usr/bin/python2
+import unittest
+import time
+
+from xhotkeys import latency
+
+class XhotkeysLatencyTest(unittest.TestCase):
+
+    def test_rolling_histogram(self):
+        histogram = latency.RollingHistogram(size=100)
+        self.assertEqual(None, histogram.percentile(50))
+        for value in range(1000):
+            histogram.add(value)
+        summary = histogram.get_summary()
+        self.assertEqual(1000, summary["count"])
+        self.assertEqual(999, summary["max"])
+        self.assertEqual(950, summary["p50"])
+        self.assertEqual(994, summary["p95"])
+        self.assertEqual(998, summary["p99"])
+
+    def test_recorder(self):
+        recorder = latency.LatencyRecorder()
+        recorder.record("match")
+        self.assertEqual({"hotkeys": {}}, recorder.get_report())
+        for delay in (0, 5, 2):
+            recorder.start_event(1000 - delay)
+            recorder.record("match", "terminal")
+            recorder.record("launch", "terminal")
+        report = recorder.get_report()
+        self.assertEqual(3, report["delivery"]["count"])
+        self.assertTrue(report["delivery"]["max"] >= 5)
+        self.assertEqual(["launch", "match"], 
+            sorted(report["hotkeys"]["terminal"]))
+        self.assertTrue(report["launch"]["p50"] >= report["match"]["p50"] >= 0)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(XhotkeysLatencyTest)
+
+if __name__ == '__main__':
+    unittest.main()
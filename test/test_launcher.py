@@ -0,0 +1,96 @@
+#!/usr/bin/python2
+import unittest
+import tempfile
+import time
+import os
+
+from xhotkeys import launcher as xhlauncher
+
+def wait_responses(launcher, count, timeout=5.0):
+    responses = []
+    end = time.time() + timeout
+    while len(responses) < count and time.time() < end:
+        responses.extend(launcher.read_responses())
+        time.sleep(0.01)
+    return responses
+
+class XhotkeysLauncherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.launcher = xhlauncher.ForkServerLauncher()
+        self.launcher.start()
+
+    def tearDown(self):
+        self.launcher.stop()
+        
+    def test_get_command_args(self):
+        self.assertEqual(["xterm", "-e", "top"], 
+            xhlauncher.get_command_args("xterm -e top"))
+        self.assertEqual(["/bin/sh", "-c", "abiword ~/readme.txt"], 
+            xhlauncher.get_command_args("abiword ~/readme.txt"))
+        self.assertEqual(["ls", "-l"], 
+            xhlauncher.get_command_args(["ls", "-l"]))
+        self.assertEqual(["/bin/sh", "-c", "cd /tmp"], 
+            xhlauncher.get_command_args("cd /tmp"))
+        self.assertRaises(ValueError, xhlauncher.get_command_args, "  ")
+
+    def test_message_reader(self):
+        fdr, fdw = os.pipe()
+        xhlauncher.write_message(fdw, ("started", 1, 1234))
+        xhlauncher.write_message(fdw, ("exited", 1234, 0))
+        data = os.read(fdr, 1024)
+        reader = xhlauncher.MessageReader()
+        self.assertEqual([("started", 1, 1234)], reader.feed(data[:-3]))
+        self.assertEqual([("exited", 1234, 0)], reader.feed(data[-3:]))
+        os.close(fdr)
+        os.close(fdw)
+
+    def test_launch(self):
+        output = tempfile.NamedTemporaryFile()
+        directory = tempfile.mkdtemp()
+        command = "pwd > %s" % output.name
+        launch_id = self.launcher.launch(command, directory=directory)
+        responses = wait_responses(self.launcher, 2)
+        self.assertEqual(("started", launch_id), responses[0][:2])
+        pid = responses[0][2]
+        self.assertEqual(("exited", pid, 0), responses[1])
+        self.assertEqual(os.path.realpath(directory), 
+            os.path.realpath(open(output.name).read().strip()))
+        os.rmdir(directory)
+
+    def test_launch_environment(self):
+        output = tempfile.NamedTemporaryFile()
+        self.launcher.launch("echo $DISPLAY > %s" % output.name, 
+            environment={"DISPLAY": ":1"})
+        wait_responses(self.launcher, 2)
+        self.assertEqual(":1", open(output.name).read().strip())
+
+    def test_launch_script(self):
+        output = tempfile.NamedTemporaryFile()
+        directory = tempfile.mkdtemp()
+        script = os.path.join(directory, "script")
+        open(script, "w").write("echo script > %s\n" % output.name)
+        os.chmod(script, 0755)
+        self.launcher.launch(script)
+        responses = wait_responses(self.launcher, 2)
+        self.assertEqual(["started", "exited"], 
+            [response[0] for response in responses])
+        self.assertEqual("script", open(output.name).read().strip())
+        os.unlink(script)
+        os.rmdir(directory)
+
+    def test_launch_error(self):
+        launch_id = self.launcher.launch("/non/existing/command")
+        responses = wait_responses(self.launcher, 1)
+        self.assertEqual(("error", launch_id), responses[0][:2])
+
+    def test_stop(self):
+        self.launcher.stop()
+        self.assertFalse(self.launcher.running())
+        self.assertRaises(OSError, self.launcher.launch, "true")
+        
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(XhotkeysLauncherTest)
+ 
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 #!/usr/bin/python2
 import unittest
+import logging
 
 from xhotkeys import misc
 
@@ -28,6 +29,34 @@ class XhotkeysMiscTest(unittest.TestCase):
         self.assertEqual(1, misc.first(lst))
         self.assertEqual(1, misc.first(iter(lst)))
         self.assertEqual(None, misc.first([]))
+
+    def test_ring_buffer_handler(self):
+        handler = misc.RingBufferHandler(capacity=3)
+        logger = logging.getLogger("test_ring_buffer_handler")
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        for index in range(5):
+            logger.debug("record %d", index)
+        lines = handler.get_lines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].endswith("DEBUG: record 2"))
+        self.assertTrue(lines[-1].endswith("DEBUG: record 4"))
+
+    def test_set_verbose_level_ring_buffer(self):
+        handler = misc.RingBufferHandler(capacity=3)
+        old_handlers, old_level = logging.root.handlers[:], logging.root.level
+        try:
+            misc.set_verbose_level(1, handler)
+            logging.debug("debug record")
+            self.assertTrue(handler.get_lines()[-1].endswith("DEBUG: debug record"))
+            console_handlers = [console_handler for console_handler 
+                in logging.root.handlers if console_handler is not handler]
+            self.assertEqual([misc.get_logging_level(1)], 
+                [console_handler.level for console_handler in console_handlers])
+        finally:
+            logging.root.handlers[:] = old_handlers
+            logging.root.setLevel(old_level)
      
                                                         
 def suite():
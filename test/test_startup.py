@@ -0,0 +1,140 @@
+#!/usr/bin/python2
+"""
+Startup benchmark for xhotkeysd: time from the first import to the first
+grab active on the X server. Run it directly to see the timings (the exit
+code is 1 if they are over the maximum times):
+
+$ PYTHONPATH=. python test/test_startup.py
+
+The test suite checks the modules loaded by the import and only a generous
+time budget for the first grab, timings depend too much on the load of the 
+machine.
+"""
+import unittest
+import subprocess
+import tempfile
+import sys
+import os
+
+# Maximum times (in seconds, median of runs) before considering it a regression
+MAX_IMPORT_TIME = 0.5
+MAX_FIRST_GRAB_TIME = 1.0
+RUNS = 5
+# Maximum time (in seconds) for the first grab in the test suite
+SUITE_MAX_FIRST_GRAB_TIME = 5.0
+# Maximum number of modules loaded by the import of the daemon
+MAX_IMPORTED_MODULES = 130
+# Modules not needed until a feature is used
+OPTIONAL_MODULES = ["pyosd", "subprocess", "ctypes", "cPickle", "json", 
+    "xhotkeys.control", "xhotkeys.inotify", "xhotkeys.launcher", 
+    "xhotkeys.latency"]
+
+config_contents = """
+    [calculator]
+        binding = <Control><Alt>1
+        directory = ~
+        command = xcalc
+        show_osd = True
+
+    [terminal]
+        binding = <Control><Alt>t
+        directory = ~
+        command = xterm
+"""
+
+startup_code = """
+import sys
+import time
+itime = time.time()
+from xhotkeys import server as xhserver
+import xhotkeys
+import_time = time.time() - itime
+server = xhotkeys.XhotkeysServer(xhserver.X.LockMask | xhserver.X.Mod2Mask)
+xhserver.configure_server(server, xhserver.get_config(sys.argv[1]))
+grab_time = time.time() - itime
+server.clear_grabs()
+print import_time, grab_time, int("pyosd" in sys.modules)
+"""
+
+import_code = """
+import sys
+modules = set(sys.modules)
+from xhotkeys import server as xhserver
+print " ".join(sorted(set(sys.modules) - modules))
+"""
+
+def run_code(code, *args):
+    """Run code in a new interpreter. Return a tuple (returncode, stdout, 
+    stderr)."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    popen = subprocess.Popen([sys.executable, "-c", code] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    output, error = popen.communicate()
+    return popen.returncode, output, error
+
+def run_startup(configfile):
+    """Run the startup code in a new interpreter. Return a tuple 
+    (returncode, stdout, stderr)."""
+    return run_code(startup_code, configfile)
+
+def parse_output(output):
+    """Return (import_time, first_grab_time, pyosd_loaded) from the output
+    of the startup code."""
+    import_time, grab_time, pyosd_loaded = output.split()
+    return float(import_time), float(grab_time), bool(int(pyosd_loaded))
+
+def measure_startup(configfile, runs=RUNS):
+    """Return median (import_time, first_grab_time) and if pyosd was loaded.
+    
+    Raise RuntimeError if the startup code fails."""
+    results = []
+    for index in range(runs):
+        returncode, output, error = run_startup(configfile)
+        if returncode != 0:
+            raise RuntimeError("startup code failed (exit code %d):\n%s" % 
+                (returncode, error))
+        results.append(parse_output(output))
+    median = lambda values: sorted(values)[len(values) / 2]
+    return (median([r[0] for r in results]), median([r[1] for r in results]),
+        any(r[2] for r in results))
+
+class XhotkeysStartupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.configfile = tempfile.NamedTemporaryFile()
+        self.configfile.write(config_contents)
+        self.configfile.flush()
+
+    def test_startup(self):
+        returncode, output, error = run_startup(self.configfile.name)
+        self.assertEqual(0, returncode, "startup code failed:\n%s" % error)
+        import_time, grab_time, pyosd_loaded = parse_output(output)
+        self.assertFalse(pyosd_loaded)
+        self.assertTrue(grab_time < SUITE_MAX_FIRST_GRAB_TIME, 
+            "first grab took %.1f ms" % (grab_time * 1000))
+
+    def test_imports(self):
+        returncode, output, error = run_code(import_code)
+        self.assertEqual(0, returncode, "import failed:\n%s" % error)
+        modules = output.split()
+        self.assertEqual([], [name for name in OPTIONAL_MODULES 
+            if name in modules])
+        self.assertTrue(len(modules) <= MAX_IMPORTED_MODULES,
+            "%d modules imported (maximum: %d)" % 
+            (len(modules), MAX_IMPORTED_MODULES))
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(XhotkeysStartupTest)
+
+if __name__ == '__main__':
+    configfile = tempfile.NamedTemporaryFile()
+    configfile.write(config_contents)
+    configfile.flush()
+    import_time, grab_time, pyosd_loaded = measure_startup(configfile.name)
+    print "import: %.1f ms" % (import_time * 1000)
+    print "first grab: %.1f ms" % (grab_time * 1000)
+    print "pyosd loaded: %s" % pyosd_loaded
+    if import_time >= MAX_IMPORT_TIME or grab_time >= MAX_FIRST_GRAB_TIME:
+        print "regression: maximum times are %.1f ms (import), %.1f ms (first grab)" % \
+            (MAX_IMPORT_TIME * 1000, MAX_FIRST_GRAB_TIME * 1000)
+        sys.exit(1)
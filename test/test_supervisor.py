@@ -0,0 +1,72 @@
+#!/usr/bin/python2
+import unittest
+import subprocess
+import signal
+import time
+import os
+
+from xhotkeys.supervisor import ChildSupervisor
+
+class XhotkeysSupervisorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.supervisor = ChildSupervisor(history=10)
+
+    def wait_children(self, timeout=5.0):
+        end = time.time() + timeout
+        while self.supervisor.children and time.time() < end:
+            self.supervisor.reap()
+            time.sleep(0.01)
+            
+    def test_reap(self):
+        for index in range(5):
+            popen = subprocess.Popen(["true"])
+            self.supervisor.add(popen.pid, "hotkey%d" % (index % 2), popen)
+        popen = subprocess.Popen(["sh", "-c", "exit 3"])
+        self.supervisor.add(popen.pid, "failing", popen)
+        self.assertEqual(3, len(self.supervisor.get_children("hotkey0")))
+        self.assertEqual(6, len(self.supervisor.get_children()))
+        self.wait_children()
+        self.assertEqual({}, self.supervisor.get_table())
+        self.assertEqual(6, len(self.supervisor.finished))
+        failing, = [c for c in self.supervisor.finished if c.hotkey == "failing"]
+        self.assertEqual(3, failing.returncode)
+        self.assertEqual(3, popen.returncode)
+        self.assertRaises(OSError, os.waitpid, popen.pid, os.WNOHANG)
+
+    def test_launch(self):
+        self.supervisor.add_launch(1, "terminal")
+        self.supervisor.add_launch(2, "editor")
+        self.supervisor.launch_started(1, 12345)
+        self.supervisor.launch_failed(2)
+        self.assertEqual({}, self.supervisor.launches)
+        self.assertEqual(["terminal"], self.supervisor.get_table().keys())
+        child = self.supervisor.finish(12345, 9) # killed by SIGKILL
+        self.assertEqual("terminal", child.hotkey)
+        self.assertEqual(-signal.SIGKILL, child.returncode)
+        self.assertEqual(None, self.supervisor.finish(12345, 0))
+
+    def test_launcher_stopped(self):
+        self.supervisor.add_launch(1, "terminal")
+        self.supervisor.add_launch(2, "terminal")
+        self.supervisor.launch_started(1, 12345)
+        self.supervisor.add(12346, "terminal")
+        self.assertEqual(3, self.supervisor.count_instances("terminal"))
+        self.supervisor.launcher_stopped()
+        self.assertEqual([12346], [child.pid 
+            for child in self.supervisor.get_children("terminal")])
+
+    def test_rename(self):
+        self.supervisor.add_launch(1, "terminal")
+        self.supervisor.add(12345, "terminal")
+        self.supervisor.add(12346, "editor")
+        self.supervisor.rename("terminal", "xterm")
+        self.assertEqual(0, self.supervisor.count_instances("terminal"))
+        self.assertEqual(2, self.supervisor.count_instances("xterm"))
+        self.assertEqual(1, self.supervisor.count_instances("editor"))
+        
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(XhotkeysSupervisorTest)
+ 
+if __name__ == '__main__':
+    unittest.main()
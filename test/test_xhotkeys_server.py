@@ -11,19 +11,32 @@ import Xlib.X
 
 import xhotkeys
 from xhotkeys import server as xhserver
+from xhotkeys import control
+from xhotkeys.launcher import set_nonblocking
+from xhotkeys.latency import LatencyRecorder
 
 config = {
     "calculator": { 
         "binding": "<Control><Alt>1",
         "directory": "~",
         "command": "xcalc",
-        "show_osd": False
+        "show_osd": False,
+        "active": True,
+        "repeat": "repeat",
+        "single_instance": False,
+        "max_instances": 2,
+        "instance_signal": "",
     },
     "abiword": {
         "binding": "<Control><Alt>Button2",
         "directory": "~/mydocs/",
         "command": "abiword ~/mydocs/readme.txt",
-        "show_osd": True
+        "show_osd": True,
+        "active": True,
+        "repeat": "once",
+        "single_instance": True,
+        "max_instances": 0,
+        "instance_signal": "SIGUSR1",
     },        
 }
 
@@ -33,58 +46,192 @@ config_contents = """
         directory = ~
         command = xcalc
         show_osd = False
+        repeat = repeat
+        max_instances = 2
 
     [abiword]
         binding = <Control><Alt>Button2
         directory = ~/mydocs/
         command = abiword ~/mydocs/readme.txt
         show_osd = True
+        single_instance = True
+        instance_signal = SIGUSR1
 """
             
 class XhotkeysServerTest(unittest.TestCase):
         
     def setUp(self):
         self.display = Xlib.display.Display()
+        self.patched = []
+        
+    def tearDown(self):
+        for obj, name, value in reversed(self.patched):
+            setattr(obj, name, value)
+
+    def patch(self, obj, name, value):
+        """Set obj.name to value until the test ends."""
+        self.patched.append((obj, name, getattr(obj, name)))
+        setattr(obj, name, value)
         
     def test_get_on_terminate(self):
         server = mocks.Mock()
         server.clear_grabs = mocks.MockCallable()
+        server.display = mocks.Mock()
+        server.display.flush = mocks.MockCallable()
+        server.servers = []
         fd, pidfile = tempfile.mkstemp()
-        sys.exit = mocks.MockCallable()
+        self.patch(sys, "exit", mocks.MockCallable())
         xhserver.on_terminate(signum=0, frame=0, server=server, pidfile=pidfile)
         self.assertTrue(mocks.get_calls(server.clear_grabs))        
         self.assertFalse(os.path.exists(pidfile))        
         self.assertTrue(mocks.get_calls(sys.exit))    
 
     def test_on_sigchild(self):
-        os.wait = mocks.MockCallable(responses=(mocks.SCALAR, lambda: (12345, 0)))        
+        self.patch(os, "wait", 
+            mocks.MockCallable(responses=(mocks.SCALAR, lambda: (12345, 0))))        
         xhserver.on_sigchild(signum=0, frame=0)
+        self.assertFalse(mocks.get_calls(os.wait))
+
+    def test_on_wakeup(self):
+        fdr, fdw = os.pipe()
+        set_nonblocking(fdr)
+        os.write(fdw, "\0")
+        supervisor = mocks.Mock()
+        supervisor.reap = mocks.MockCallable()
+        xhserver.on_wakeup(fdr, supervisor)
+        self.assertTrue(mocks.get_calls(supervisor.reap))
+        self.assertEqual([], xhotkeys.wait_for_input([fdr], timeout=0.0))
+        os.close(fdr)
+        os.close(fdw)
 
     def test_on_sighup(self):
         self.assertRaises(xhserver.XhotkeysServerReload, 
             xhserver.on_sighup, signum=0, frame=0)
 
-    def test_on_hotkey(self):
-        popen = xhserver.on_hotkey(["/bin/echo", "hello"], 
+    def test_run_command(self):
+        popen = xhserver.run_command(["/bin/echo", "hello"], 
             shell=False, directory=None, stdout=subprocess.PIPE)
         self.assertTrue(popen)
         self.assertEqual(('hello\n', None), popen.communicate())
         
-        popen = xhserver.on_hotkey("echo hello", 
+        popen = xhserver.run_command("echo hello", 
             shell=True, directory=None, stdout=subprocess.PIPE)
         self.assertTrue(popen)
         self.assertEqual(('hello\n', None), popen.communicate())
 
-        popen = xhserver.on_hotkey(["./echo", "hello"], 
+        popen = xhserver.run_command(["./echo", "hello"], 
             shell=False, directory="/bin", stdout=subprocess.PIPE)
         self.assertTrue(popen)
         self.assertEqual(('hello\n', None), popen.communicate())
 
+        cwd = os.getcwd()
+        popen = xhserver.run_command("pwd", 
+            shell=True, directory="/bin", stdout=subprocess.PIPE)
+        self.assertTrue(popen)
+        output, error = popen.communicate()
+        self.assertEqual(os.path.realpath("/bin"), os.path.realpath(output.strip()))
+        self.assertEqual(cwd, os.getcwd())
+
+    def test_launch_empty_command(self):
+        self.patch(xhserver, "run_command", mocks.MockCallable())
+        self.assertEqual(None, xhserver.launch_command("  "))
+        self.assertFalse(mocks.get_calls(xhserver.run_command))
+
+    def test_get_display_environment(self):
+        server = mocks.Struct(display=mocks.Struct(
+            get_display_name=lambda: "localhost:10.0"))
+        self.assertEqual({"DISPLAY": "localhost:10.1"}, 
+            xhserver.get_display_environment(server, 1))
+        server.display.get_display_name = lambda: ":1"
+        self.assertEqual({"DISPLAY": ":1.0"}, 
+            xhserver.get_display_environment(server))
+
+    def test_get_hotkey_directory(self):
+        hotkey = mocks.Struct(name="hotkey", directory="~")
+        self.assertEqual(os.path.expanduser("~"), 
+            xhserver.get_hotkey_directory(hotkey))
+        hotkey.directory = "/non/existing/directory"
+        self.assertEqual(None, xhserver.get_hotkey_directory(hotkey))
+        hotkey.directory = ""
+        self.assertEqual(None, xhserver.get_hotkey_directory(hotkey))
+
+    def test_build_combinations_trie(self):
+        hotkey1 = mocks.Struct(name="hotkey1")
+        hotkey2 = mocks.Struct(name="hotkey2")
+        a, b, c = [("keyboard", Xlib.X.ControlMask, kc) for kc in (10, 11, 12)]
+        trie = xhserver.build_combinations_trie({hotkey1: [a, b], hotkey2: [a, c]})
+        self.assertEqual([a], trie.keys())
+        hotkey, children = trie[a]
+        self.assertEqual(None, hotkey)
+        self.assertEqual({b: (hotkey1, {}), c: (hotkey2, {})}, children)
+        
+    def test_on_hotkey(self):
+        hotkey1 = mocks.Struct(name="hotkey1", command="cmd1", 
+            directory=None, show_osd=False)
+        a, b, c = [("keyboard", Xlib.X.ControlMask, kc) for kc in (10, 11, 12)]
+        state = mocks.Struct(trie=xhserver.build_combinations_trie(
+            {hotkey1: [a, b]}), node=None, timeout=None, launcher=None,
+            supervisor=None, directories={hotkey1: None},
+            latency=LatencyRecorder(), repeat_intervals={hotkey1: None},
+            last_run=None, environments=None)
+        xhserver.reset_combination_state(state)
+        self.patch(xhserver, "run_command", mocks.MockCallable())
+        xhserver.on_hotkey(state, a)
+        xhserver.on_hotkey(state, c)
+        xhserver.on_hotkey(state, a)
+        self.assertFalse(mocks.get_calls(xhserver.run_command))
+        state.latency.start_event()
+        xhserver.on_hotkey(state, b)
+        self.assertEqual([("cmd1",)], mocks.get_calls_args(xhserver.run_command))
+        self.assertTrue(state.node is state.trie)
+        report = state.latency.get_report()
+        self.assertEqual(1, report["hotkeys"]["hotkey1"]["launch"]["count"])
+
+    def test_on_hotkey_repeat(self):
+        hotkey1 = mocks.Struct(name="hotkey1", command="cmd1", 
+            directory=None, show_osd=False, repeat="once")
+        hotkey2 = mocks.Struct(name="hotkey2", command="cmd2", 
+            directory=None, show_osd=False, repeat="repeat")
+        a, b = [("keyboard", Xlib.X.ControlMask, kc) for kc in (10, 11)]
+        hotkeys = {hotkey1: [a], hotkey2: [b]}
+        state = mocks.Struct(trie=xhserver.build_combinations_trie(hotkeys), 
+            node=None, timeout=None, launcher=None, supervisor=None, 
+            directories={}, latency=None, 
+            repeat_intervals=dict((hotkey, xhserver.get_repeat_interval(hotkey)) 
+                for hotkey in hotkeys), last_run=None, environments=None)
+        xhserver.reset_combination_state(state)
+        self.patch(xhserver, "run_command", mocks.MockCallable())
+        for combination in (a, b):
+            xhserver.on_hotkey(state, combination)
+            xhserver.on_hotkey(state, combination, True)
+            xhserver.on_hotkey(state, combination, True)
+        self.assertEqual([("cmd1",), ("cmd2",), ("cmd2",), ("cmd2",)], 
+            mocks.get_calls_args(xhserver.run_command))
+        self.assertEqual(0.5, xhserver.get_repeat_interval(
+            mocks.Struct(name="hotkey3", repeat="2")))
+
+    def test_check_instances(self):
+        hotkey = xhserver.Hotkey("editor", dict(command="sleep 10", 
+            max_instances="2", instance_signal="TERM"))
+        supervisor = xhserver.ChildSupervisor()
+        state = mocks.Struct(supervisor=supervisor)
+        self.assertTrue(xhserver.check_instances(state, hotkey))
+        supervisor.add_launch(1, "editor")
+        popen = subprocess.Popen(["sleep", "10"])
+        supervisor.add(popen.pid, "editor", popen)
+        self.assertFalse(xhserver.check_instances(state, hotkey))
+        self.assertEqual(-signal.SIGTERM, popen.wait())
+        supervisor.launch_failed(1)
+        hotkey.update(dict(max_instances=0, single_instance=True))
+        self.assertFalse(xhserver.check_instances(state, hotkey))
+        self.assertEqual(signal.SIGUSR1, xhserver.get_signal_number("sigusr1"))
+        self.assertEqual(None, xhserver.get_signal_number(""))
+
     def test_set_signal_handlers(self):
         server = xhotkeys.XhotkeysServer(
             Xlib.X.LockMask | Xlib.X.Mod2Mask | Xlib.X.Mod5Mask)
         pidfile = tempfile.NamedTemporaryFile()
-        signal.signal = mocks.MockCallable()
+        self.patch(signal, "signal", mocks.MockCallable())
         xhserver.set_signal_handlers(server=server, pidfile=pidfile.name)
         self.assertEqual(4, 
             len(mocks.get_calls(signal.signal)))
@@ -93,32 +240,38 @@ class XhotkeysServerTest(unittest.TestCase):
     def test_configure_server(self):
         server = xhotkeys.XhotkeysServer(
             Xlib.X.LockMask | Xlib.X.Mod2Mask | Xlib.X.Mod5Mask)
-
-        server.add_key_grab = mocks.MockCallable()
-        server.add_button_grab = mocks.MockCallable()
+        server.set_grabs = mocks.MockCallable(
+            responses=(mocks.SCALAR, lambda grabs: [None] * len(grabs)))
         fd = StringIO.StringIO(config_contents)
         hotkeys = xhserver.get_config(fd)
         xhserver.configure_server(server, hotkeys)
-        expected_key_grabs = [(
-            self.display.keysym_to_keycode(Xlib.XK.XK_1),
-            Xlib.X.ControlMask | Xlib.X.Mod1Mask, 
-            xhserver.on_hotkey, 
-            'xcalc', 
-            True, 
-            '~'
-        )]
-        expected_button_grabs = [(
-            2,
-            Xlib.X.ControlMask | Xlib.X.Mod1Mask, 
-            xhserver.on_hotkey, 
-            'abiword ~/mydocs/readme.txt', 
-            True, 
-            '~/mydocs/'
-        )]
-        self.assertEqual(expected_button_grabs,
-            mocks.get_calls_args(server.add_button_grab))
-        self.assertEqual(expected_key_grabs,
-            mocks.get_calls_args(server.add_key_grab))
+        expected_grabs = [
+            (Xlib.X.KeyPress, self.display.keysym_to_keycode(Xlib.XK.XK_1),
+                Xlib.X.ControlMask | Xlib.X.Mod1Mask),
+            (Xlib.X.ButtonPress, 2, Xlib.X.ControlMask | Xlib.X.Mod1Mask),
+        ]
+        grabs, = mocks.get_calls_args(server.set_grabs)[0]
+        self.assertEqual(sorted(expected_grabs), 
+            sorted((event_type, code, mask) 
+                for (event_type, code, mask, callback, args) in grabs))
+            
+    def test_get_binding_combinations(self):
+        mask = Xlib.X.ControlMask | Xlib.X.Mod1Mask
+        self.assertEqual([
+                ("keyboard", mask, self.display.keysym_to_keycode(Xlib.XK.XK_t)),
+                ("keyboard", mask, 38),
+                ("mouse", mask, 1),
+            ], xhserver.get_binding_combinations("<Control><Alt>t+#38+Button1"))
+
+    def test_get_compiled_bindings(self):
+        hotkeys = xhserver.get_config(StringIO.StringIO(config_contents))
+        cachefile = tempfile.NamedTemporaryFile()
+        compiled = xhserver.get_compiled_bindings(hotkeys, cachefile=cachefile.name)
+        self.assertEqual(set(["calculator", "abiword"]), set(compiled))
+        self.patch(xhotkeys, "get_keycode", mocks.MockCallable())
+        self.assertEqual(compiled, xhserver.get_compiled_bindings(
+            hotkeys, cachefile=cachefile.name))
+        self.assertFalse(mocks.get_calls(xhotkeys.get_keycode))
             
     def test_start_server(self):
         def get_config_callback():
@@ -128,11 +281,79 @@ class XhotkeysServerTest(unittest.TestCase):
         server.add_button_grab = mocks.MockCallable()
         server.add_key_grab = mocks.MockCallable()
         server.run = mocks.MockCallable()
-        xhotkeys.XhotkeysServer = mocks.MockCallable(
-            responses=(mocks.SCALAR, lambda *args: server))
+        self.patch(xhotkeys, "XhotkeysServer", mocks.MockCallable(
+            responses=(mocks.SCALAR, lambda *args: server)))
         pidfile = tempfile.NamedTemporaryFile()                      
         xhserver.start_server(get_config_callback, pidfile=pidfile.name)
                                             
+    def test_watch_config_file(self):
+        directory = tempfile.mkdtemp()
+        configfile = os.path.join(directory, "xhotkeysrc")
+        open(configfile, "w").write(config_contents)
+        server = xhotkeys.XhotkeysServer(Xlib.X.LockMask, display=self.display)
+        daemon = xhotkeys.misc.Struct("daemon", server=server, 
+            config_hash=None, reload_timeout=None)
+        self.assertTrue(xhserver.watch_config_file(daemon, configfile))
+        notifier, = server.watches
+        callback, args = server.watches[notifier]
+        open(os.path.join(directory, "other"), "w").write("")
+        callback(*args)
+        self.assertFalse(server.timeouts)
+        for index in range(3):
+            open(configfile, "w").write(config_contents)
+            callback(*args)
+        self.assertEqual(1, len(server.timeouts))
+        # Same contents: no reload
+        deadline, timeout_id, reload_callback, reload_args = server.timeouts.pop()
+        reload_callback(*reload_args)
+        tmpfile = configfile + ".tmp"
+        open(tmpfile, "w").write(config_contents + "\n")
+        os.rename(tmpfile, configfile)
+        callback(*args)
+        deadline, timeout_id, reload_callback, reload_args = server.timeouts.pop()
+        self.assertRaises(xhserver.XhotkeysServerReload, 
+            reload_callback, *reload_args)
+
+    def test_control_commands(self):
+        configfile = tempfile.NamedTemporaryFile()
+        configfile.write(config_contents)
+        configfile.flush()
+        server = xhotkeys.XhotkeysServer(Xlib.X.LockMask, display=self.display)
+        daemon = xhotkeys.misc.Struct("daemon", server=server, hotkeys=[],
+            launcher=None, supervisor=xhserver.ChildSupervisor(), 
+            cachefile=None, configfile=configfile.name, state=None, states=[],
+            get_config_callback=lambda: xhserver.get_config(configfile.name),
+            config_hash=None, reload_timeout=None)
+        try:
+            self.assertEqual({"failed": []}, xhserver.control_reload(daemon))
+            self.assertEqual(2, len(xhserver.control_grabs(daemon)))
+            self.assertEqual({"grabbed": True}, xhserver.control_add(daemon, 
+                "editor", {"binding": "<Control><Alt>e", "command": "gvim"}))
+            self.assertRaises(control.ControlError, 
+                xhserver.control_add, daemon, "editor", {"command": "vi"})
+            self.assertRaises(control.ControlError, 
+                xhserver.control_update, daemon, "editor", {"command": ""})
+            self.assertRaises(control.ControlError, 
+                xhserver.control_add, daemon, "other", "abc")
+            self.assertRaises(control.ControlError, 
+                xhserver.control_update, daemon, "editor", 
+                {"command": "vi", "max_instances": "many"})
+            self.assertEqual("gvim", xhserver.find_hotkey(daemon, "editor").command)
+            xhserver.control_update(daemon, "editor", {"active": False})
+            xhserver.control_remove(daemon, "calculator")
+            self.assertEqual(1, len(xhserver.control_grabs(daemon)))
+            self.assertEqual(xhserver.get_file_hash(configfile.name), 
+                daemon.config_hash)
+            status = xhserver.control_status(daemon)
+            self.assertEqual(os.getpid(), status["pid"])
+            self.assertEqual(["abiword", "editor"], sorted(hotkey.name 
+                for hotkey in xhserver.get_config(configfile.name)))
+            daemon.supervisor.add(12345, "editor")
+            xhserver.control_update(daemon, "editor", {"name": "vim"})
+            self.assertEqual(1, daemon.supervisor.count_instances("vim"))
+        finally:
+            server.clear_grabs()
+
     def test_get_config(self):
         fd = StringIO.StringIO(config_contents)
         items = [(x.name, x.get_attributes()) for x in xhserver.get_config(fd)]
@@ -153,12 +374,12 @@ class XhotkeysServerTest(unittest.TestCase):
     def test_main(self):
         conf = tempfile.NamedTemporaryFile()
         conf.write(config_contents)        
-        xhserver.start_server = mocks.MockCallable()
+        self.patch(xhserver, "start_server", mocks.MockCallable())
         xhserver.main(["-c", conf.name])
         self.assertTrue(mocks.get_calls_args(xhserver.start_server)) 
 
     def test_main_keyboard_info(self):
-        sys.stdout = StringIO.StringIO()
+        self.patch(sys, "stdout", StringIO.StringIO())
         xhserver.main(["-i"])
         self.assertTrue(sys.stdout.getvalue())
         
@@ -1,7 +1,9 @@
 #!/usr/bin/python2
 import unittest
+import os
 import xhotkeys
 import Xlib.XK
+import Xlib.error
 import mocks
 
 def get_mocks():
@@ -23,7 +25,30 @@ class XhotkeysTest(unittest.TestCase):
         self.assertEqual(Xlib.XK.XK_Cancel, xhotkeys.get_keysym("Cancel"))
         self.assertEqual(Xlib.XK.XK_A, xhotkeys.get_keysym("A"))
         self.assertEqual(Xlib.XK.XK_Up, xhotkeys.get_keysym("Up"))
+        self.assertEqual(Xlib.XK.XK_a, xhotkeys.get_keysym("a"))
+        self.assertEqual(Xlib.XK.XK_Return, xhotkeys.get_keysym("return"))
+        self.assertRaises(AttributeError, xhotkeys.get_keysym, "NoSuchKey")
 
+    def test_get_keysym_to_string_mapping(self):
+        mapping = xhotkeys.get_keysym_to_string_mapping()
+        self.assertEqual("Cancel", mapping[Xlib.XK.XK_Cancel])
+        self.assertTrue(mapping is xhotkeys.get_keysym_to_string_mapping())
+
+    def test_get_display(self):
+        self.assertTrue(xhotkeys.get_display() is xhotkeys.get_display())
+
+    def test_get_keycode(self):
+        display = xhotkeys.get_display()
+        xhotkeys.clear_keycodes_cache()
+        self.assertEqual(display.keysym_to_keycode(Xlib.XK.XK_A),
+            xhotkeys.get_keycode("A"))
+        display.keysym_to_keycode = mocks.MockCallable()
+        try:
+            xhotkeys.get_keycode("A")
+            self.assertEqual(0, len(mocks.get_calls(display.keysym_to_keycode)))
+        finally:
+            del display.keysym_to_keycode
+            
     def test_get_mask_combinations(self):
         self.assertEqual([0x0, 0x1, 0x10, 0x11], 
             xhotkeys.get_mask_combinations(0x11))   
@@ -78,6 +103,14 @@ class XhotkeysTest(unittest.TestCase):
             ignore_masks=ignore_masks)
         self.assertEqual(expected_grab_button, grab_buttons)
 
+    def test_wait_for_input(self):
+        fdr, fdw = os.pipe()
+        self.assertEqual([], xhotkeys.wait_for_input([fdr], timeout=0.0))
+        os.write(fdw, "x")
+        self.assertEqual([fdr], xhotkeys.wait_for_input([fdr], timeout=0.0))
+        os.close(fdr)
+        os.close(fdw)
+
 
 class XhotkeysServerTest(unittest.TestCase):
     def setUp(self):
@@ -105,6 +138,48 @@ class XhotkeysServerTest(unittest.TestCase):
         self.assertEqual(8, len(mocks.get_calls_args(self.root.grab_button)))
         self.assertEqual(1, len(self.server.callbacks))
 
+    def test_add_grabs(self):
+        def grab_key(*args, **kwargs):
+            if args[0] == bkc:
+                kwargs["onerror"]("BadAccess", None)
+        akc = self.display.keysym_to_keycode(Xlib.XK.XK_A)
+        bkc = self.display.keysym_to_keycode(Xlib.XK.XK_B)
+        self.root.grab_key = mocks.MockCallable(
+            responses=(mocks.SCALAR, grab_key))
+        mask = Xlib.X.ControlMask | Xlib.X.Mod1Mask
+        callback = mocks.MockCallable()
+        errors = self.server.add_grabs([
+            (Xlib.X.KeyPress, akc, mask, callback, ()),
+            (Xlib.X.KeyPress, bkc, mask, callback, ()),
+            (Xlib.X.ButtonPress, 3, mask, callback, ()),
+        ])
+        self.assertEqual([None, "BadAccess", None], errors)
+        self.assertEqual(16, len(mocks.get_calls_args(self.root.grab_key)))
+        self.assertEqual(8, len(mocks.get_calls_args(self.root.grab_button)))
+        self.assertEqual(8, len(mocks.get_calls_args(self.root.ungrab_key)))
+        self.assertEqual(2, len(self.server.callbacks))
+        
+    def test_set_grabs(self):
+        mask = Xlib.X.ControlMask | Xlib.X.Mod1Mask
+        callback1 = mocks.MockCallable()
+        callback2 = mocks.MockCallable()
+        self.server.set_grabs([
+            (Xlib.X.KeyPress, 10, mask, callback1, ()),
+            (Xlib.X.KeyPress, 11, mask, callback1, ()),
+        ])
+        self.assertEqual(16, len(mocks.get_calls_args(self.root.grab_key)))
+        errors = self.server.set_grabs([
+            (Xlib.X.KeyPress, 11, mask, callback2, ()),
+            (Xlib.X.ButtonPress, 3, mask, callback2, ()),
+        ])
+        self.assertEqual([None, None], errors)
+        self.assertEqual(16, len(mocks.get_calls_args(self.root.grab_key)))
+        self.assertEqual(8, len(mocks.get_calls_args(self.root.ungrab_key)))
+        self.assertEqual(8, len(mocks.get_calls_args(self.root.grab_button)))
+        self.assertEqual((callback2, ()), 
+            self.server.callbacks[(Xlib.X.KeyPress, 11, mask)])
+        self.assertEqual(2, len(self.server.callbacks))
+        
     def test_clear_grabs(self):
         self.server.callbacks = {"forced": 1}            
         self.server.clear_grabs()
@@ -115,7 +190,7 @@ class XhotkeysServerTest(unittest.TestCase):
         responses = {
             "pending_events": 
                 (mocks.LIST, 
-                    [lambda: 3, lambda: 2, lambda: 1, lambda: None]),
+                    [lambda: 3, lambda: None]),
             "next_event":
                 (mocks.LIST, [
                     lambda: mocks.Struct(type=Xlib.X.KeyPress, 
@@ -144,9 +219,124 @@ class XhotkeysServerTest(unittest.TestCase):
             button=3, 
             modifiers=Xlib.X.ControlMask | Xlib.X.Mod1Mask, 
             callback=callback2)
-        self.server.run(looptime=0.0)
+        self.server.run()
         self.assertEqual(2, len(mocks.get_calls(callback1)))
         self.assertEqual(1, len(mocks.get_calls(callback2)))
+        self.assertEqual({}, self.server.unknown_events)
+        event = mocks.Struct(type=Xlib.X.KeyPress, state=0, detail=akc)
+        self.server.dispatch_event(event)
+        self.server.dispatch_event(event)
+        self.assertEqual({(Xlib.X.KeyPress, akc, 0): 2}, self.server.unknown_events)
+        
+    def test_multiple_roots(self):
+        root2 = mocks.MockRoot()
+        self.server.roots.append(root2)
+        mask = Xlib.X.ControlMask | Xlib.X.Mod1Mask
+        self.server.set_grabs([(Xlib.X.KeyPress, 10, mask, None, ())])
+        self.assertEqual(8, len(mocks.get_calls_args(self.root.grab_key)))
+        self.assertEqual(8, len(mocks.get_calls_args(root2.grab_key)))
+        self.server.set_grabs([])
+        self.assertEqual(8, len(mocks.get_calls_args(root2.ungrab_key)))
+
+    def test_add_server(self):
+        akc = self.display.keysym_to_keycode(Xlib.XK.XK_A)
+        def connection_closed():
+            raise Xlib.error.ConnectionClosedError("server")
+        display2 = mocks.Mock()
+        display2.pending_events = mocks.MockCallable(
+            responses=(mocks.LIST, [lambda: 1, connection_closed]))
+        display2.next_event = mocks.MockCallable(responses=(mocks.LIST, 
+            [lambda: mocks.Struct(type=Xlib.X.KeyPress, state=0, detail=akc)]))
+        display2.get_display_name = lambda: ":1"
+        server2 = xhotkeys.XhotkeysServer(Xlib.X.LockMask, display=display2,
+            root=mocks.MockRoot())
+        callback = mocks.MockCallable()
+        server2._add_callback(Xlib.X.KeyPress, akc, 0, callback, ("display2",))
+        closed = []
+        self.server.add_server(server2, closed.append)
+        self.server.display.pending_events = mocks.MockCallable(
+            responses=(mocks.LIST, [lambda: 1, lambda: 1, lambda: None]))
+        self.server.display.next_event = mocks.MockCallable(
+            responses=(mocks.LIST, [lambda: mocks.Struct(type=Xlib.X.KeyPress, 
+                state=Xlib.X.ControlMask, detail=akc)] * 2))
+        self.server.run()
+        self.assertEqual([("display2",)], mocks.get_calls_args(callback))
+        # connection of server2 closed on the second iteration
+        self.assertEqual([], self.server.servers)
+        self.assertEqual([server2], closed)
+
+    def test_dispatch_table(self):
+        mask = Xlib.X.ControlMask
+        calls = []
+        self.server.set_grabs([(Xlib.X.KeyPress, 10, mask, calls.append, (1,))])
+        event = mocks.Struct(type=Xlib.X.KeyPress, detail=10,
+            state=mask | Xlib.X.LockMask)
+        self.server.dispatch_event(event)
+        self.assertEqual({xhotkeys.pack_combination(Xlib.X.KeyPress, 10, mask): 
+            (calls.append, (1,))}, self.server.dispatch_table)
+        self.server.set_grabs([(Xlib.X.KeyPress, 10, mask, calls.append, (2,))])
+        self.assertEqual(None, self.server.dispatch_table)
+        self.server.dispatch_event(event)
+        self.server.set_grabs([])
+        self.server.dispatch_event(event)
+        self.assertEqual([1, 2], calls)
+        self.assertEqual({(Xlib.X.KeyPress, 10, mask): 1}, 
+            self.server.unknown_events)
+
+    def test_auto_repeat(self):
+        akc = self.display.keysym_to_keycode(Xlib.XK.XK_A)
+        repeats = []
+        def callback():
+            repeats.append(self.server.repeat)
+        self.server.add_key_grab(akc, Xlib.X.ControlMask, callback)
+        for event_type, time in [(Xlib.X.KeyPress, 100), (Xlib.X.KeyRelease, 200), 
+                (Xlib.X.KeyPress, 200), (Xlib.X.KeyRelease, 300), (Xlib.X.KeyPress, 400)]:
+            self.server.dispatch_event(mocks.Struct(type=event_type, 
+                state=Xlib.X.ControlMask, detail=akc, time=time))
+        self.assertEqual([False, True, False], repeats)
+
+    def test_pass_event_info(self):
+        akc = self.display.keysym_to_keycode(Xlib.XK.XK_A)
+        executor = mocks.Mock()
+        executor.submit = mocks.MockCallable()
+        self.server.executor = executor
+        self.server.pass_event_info = True
+        root2 = mocks.MockRoot()
+        self.server.screens[root2] = 1
+        self.server.add_key_grab(akc, Xlib.X.ControlMask, "callback", "arg")
+        for event_type, time, root in [(Xlib.X.KeyPress, 100, self.server.root), 
+                (Xlib.X.KeyRelease, 200, root2), (Xlib.X.KeyPress, 200, root2)]:
+            self.server.dispatch_event(mocks.Struct(type=event_type, 
+                state=Xlib.X.ControlMask, detail=akc, time=time, root=root))
+        self.assertEqual([("callback", ("arg", False, 0)), 
+            ("callback", ("arg", True, 1))], mocks.get_calls_args(executor.submit))
+
+    def test_run_timeouts(self):
+        callback1 = mocks.MockCallable()
+        callback2 = mocks.MockCallable()
+        self.server.add_timeout(0, callback1, "arg1")
+        timeout_id = self.server.add_timeout(0, callback2, "arg2")
+        self.server.add_timeout(60, callback2, "arg3")
+        self.server.remove_timeout(timeout_id)
+        delay = self.server.run_timeouts()
+        self.assertEqual([("arg1",)], mocks.get_calls_args(callback1))
+        self.assertFalse(mocks.get_calls(callback2))
+        self.assertTrue(0 < delay <= 60)
+
+    def test_mapping_notify(self):
+        mapping_event = lambda: mocks.Struct(type=Xlib.X.MappingNotify, 
+            request=Xlib.X.MappingKeyboard, first_keycode=10, count=2)
+        self.server.display.pending_events = mocks.MockCallable(
+            responses=(mocks.LIST, [lambda: 3, lambda: None]))
+        self.server.display.next_event = mocks.MockCallable(
+            responses=(mocks.LIST, [mapping_event] * 3))
+        self.server.display.refresh_keyboard_mapping = mocks.MockCallable()
+        callback = mocks.MockCallable()
+        self.server.add_mapping_callback(callback, "arg")
+        self.server.run()
+        self.assertEqual(3, 
+            len(mocks.get_calls(self.server.display.refresh_keyboard_mapping)))
+        self.assertEqual([("arg",)], mocks.get_calls_args(callback))
         
 def suite():
     suite = unittest.TestLoader().loadTestsFromTestCase(XhotkeysTest)
@@ -0,0 +1,96 @@
+#!/usr/bin/python2
+"""
+Dispatch XhotkeysServer events from an asyncio event loop (trollius is
+used on Python 2) instead of the blocking XhotkeysServer.run:
+
+>>> @asyncio.coroutine
+>>> def callback(url):
+>>>     response = yield asyncio.From(fetch(url))
+>>>
+>>> server = xhotkeys.XhotkeysServer(ignore_mask)
+>>> server.add_key_grab(keycode, Xlib.X.ControlMask, callback, url)
+>>> future = serve(server)
+>>> loop.run_until_complete(future)
+
+Callbacks returning a coroutine (or a future) run as tasks, so a slow
+callback does not stall the others. Cancel the future to stop: the display
+is not watched anymore, running callback tasks are cancelled and the grabs
+are cleared. Other watches and timeouts of the server are not used, add
+them to the loop.
+"""
+import socket
+import logging
+
+import Xlib.error
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+# asyncio.async was renamed to asyncio.ensure_future
+ensure_future = getattr(asyncio, "ensure_future", None) or getattr(asyncio, "async")
+
+class AsyncioExecutor:
+    """Executor for XhotkeysServer (see xhotkeys.executor) that runs
+    callbacks in the loop and coroutine results as tasks."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.tasks = set()
+
+    def submit(self, callback, args=(), key=None):
+        """Run callback(*args), schedule its result if it's a coroutine."""
+        result = callback(*args)
+        if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+            task = ensure_future(result, loop=self.loop)
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return True
+
+    def cancel(self):
+        """Cancel running tasks."""
+        for task in list(self.tasks):
+            task.cancel()
+
+def serve(server, loop=None):
+    """Dispatch the events of server from loop (the default if None).
+
+    Return a future: its result is set when the X connection is closed,
+    cancel it to stop serving and clear the grabs."""
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    future = asyncio.Future(loop=loop)
+    executor = AsyncioExecutor(loop)
+    old_executor = server.executor
+    server.executor = executor
+    fd = server.display.fileno()
+
+    def on_readable():
+        if future.done():
+            return
+        # Xlib may have queued events while waiting for replies, drain them all
+        while 1:
+            try:
+                pending_events = server.process_pending_events()
+            except (Xlib.error.ConnectionClosedError, socket.error), details:
+                logging.warning("connection closed: %s", details)
+                pending_events = None
+            if pending_events is None:
+                future.set_result(None)
+                break
+            elif not pending_events:
+                break
+
+    def on_done(future):
+        loop.remove_reader(fd)
+        executor.cancel()
+        server.executor = old_executor
+        if future.cancelled():
+            server.clear_grabs()
+            server.display.flush()
+
+    loop.add_reader(fd, on_readable)
+    future.add_done_callback(on_done)
+    loop.call_soon(on_readable)
+    return future
@@ -0,0 +1,192 @@
+#!/usr/bin/python2
+"""
+Control interface for a running xhotkeys daemon.
+
+Requests and responses are JSON objects (one per line) sent through a Unix
+stream socket. A request is {"command": name, param: value, ...} and the
+response is either {"result": value} or {"error": message}:
+
+>>> send_request("/home/user/.xhotkeys.socket", "trigger", name="terminal")
+>>> send_request("/home/user/.xhotkeys.socket", "remove", name="unknown")
+Traceback (most recent call last):
+...
+ControlError: hotkey not found: unknown
+
+The daemon side (ControlServer) runs from the main loop of a XhotkeysServer.
+"""
+import os
+import json
+import errno
+import socket
+import logging
+
+from xhotkeys.launcher import set_cloexec
+
+# Default path for the control socket
+CONTROL_SOCKET = "~/.xhotkeys.socket"
+# Maximum time (in seconds) to wait for a peer
+TIMEOUT = 5.0
+
+class ControlError(Exception):
+    """Request rejected by the daemon."""
+    pass
+
+def encode_message(message):
+    """Return the line (JSON) for a message."""
+    return json.dumps(message) + "\n"
+
+def convert_strings(value):
+    """Convert unicode strings in decoded JSON value to UTF-8 strings."""
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    elif isinstance(value, list):
+        return [convert_strings(x) for x in value]
+    elif isinstance(value, dict):
+        return dict((convert_strings(k), convert_strings(v))
+            for (k, v) in value.iteritems())
+    return value
+
+def send_request(path, command, timeout=TIMEOUT, **params):
+    """Send a request to the daemon listening on path and return the result.
+
+    Raise socket.error if the daemon is not reachable and ControlError if
+    the request was rejected."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(encode_message(dict(params, command=command)))
+        data = ""
+        while "\n" not in data:
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise socket.error(errno.ECONNRESET, "connection closed by daemon")
+            data += chunk
+    finally:
+        sock.close()
+    response = convert_strings(json.loads(data.split("\n", 1)[0]))
+    if "error" in response:
+        raise ControlError(response["error"])
+    return response.get("result")
+
+def is_listening(path, timeout=1.0):
+    """Return True if a daemon answers requests on path (any reply counts,
+    even an error from a daemon that does not know the request)."""
+    try:
+        send_request(path, "status", timeout=timeout)
+    except socket.error:
+        return False
+    except ControlError:
+        pass
+    return True
+
+class ControlServer:
+    """Listen for requests on a Unix socket and run them with handlers
+    ({command: function(**params)}).
+
+    The socket and its connections are added as watches to a XhotkeysServer,
+    so requests are processed from its main loop. Handlers raise ControlError
+    to reject a request."""
+
+    def __init__(self, path, handlers):
+        self.path = path
+        self.handlers = handlers
+        self.socket = None
+        self.server = None
+        self.buffers = {}
+
+    def start(self, server):
+        """Start listening (raise socket.error if the address is in use)."""
+        if os.path.exists(self.path):
+            if is_listening(self.path):
+                raise socket.error(errno.EADDRINUSE,
+                    "a daemon is already listening on %s" % self.path)
+            logging.debug("removing stale control socket: %s", self.path)
+            os.unlink(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        set_cloexec(sock.fileno())
+        old_umask = os.umask(0077)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(5)
+        sock.setblocking(0)
+        self.socket = sock
+        self.server = server
+        server.add_watch(sock, self.on_accept)
+        logging.info("control socket listening on %s", self.path)
+
+    def on_accept(self):
+        """Called when there is a new connection to accept."""
+        try:
+            connection, address = self.socket.accept()
+        except socket.error, details:
+            if details.args[0] not in (errno.EAGAIN, errno.EINTR):
+                logging.error("cannot accept control connection: %s", details)
+            return
+        set_cloexec(connection.fileno())
+        connection.settimeout(TIMEOUT)
+        self.buffers[connection] = ""
+        self.server.add_watch(connection, self.on_connection_data, connection)
+
+    def on_connection_data(self, connection):
+        """Called when there is data to read from a connection."""
+        try:
+            data = connection.recv(65536)
+        except socket.error, details:
+            logging.debug("error on control connection: %s", details)
+            data = None
+        if not data:
+            self.close_connection(connection)
+            return
+        self.buffers[connection] += data
+        while "\n" in self.buffers[connection]:
+            line, self.buffers[connection] = self.buffers[connection].split("\n", 1)
+            try:
+                connection.sendall(encode_message(self.process_request(line)))
+            except socket.error, details:
+                logging.debug("error on control connection: %s", details)
+                self.close_connection(connection)
+                return
+
+    def process_request(self, line):
+        """Run a request line and return the response message."""
+        try:
+            request = convert_strings(json.loads(line))
+            command = request.pop("command")
+        except (ValueError, KeyError, AttributeError, TypeError):
+            return {"error": "invalid request: %s" % line}
+        handler = self.handlers.get(command)
+        if not handler:
+            return {"error": "unknown command: %s" % command}
+        logging.debug("control request: %s %s", command, request)
+        try:
+            return {"result": handler(**request)}
+        except ControlError, details:
+            return {"error": str(details)}
+        except TypeError, details:
+            return {"error": "invalid parameters for %s: %s" % (command, details)}
+        except StandardError, details:
+            # Not Exception: control-flow exceptions raised from signal
+            # handlers (like XhotkeysServerReload) must reach the main loop
+            logging.exception("error on control request: %s", command)
+            return {"error": "%s failed: %s" % (command, details)}
+
+    def close_connection(self, connection):
+        """Close a connection."""
+        self.server.remove_watch(connection)
+        del self.buffers[connection]
+        connection.close()
+
+    def stop(self):
+        """Close all connections and remove the socket."""
+        if not self.socket:
+            return
+        for connection in self.buffers.keys():
+            self.close_connection(connection)
+        self.server.remove_watch(self.socket)
+        self.socket.close()
+        self.socket = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
@@ -0,0 +1,148 @@
+#!/usr/bin/python2
+"""
+Run XhotkeysServer callbacks in a bounded pool of worker threads, so a slow
+callback does not block the event loop:
+
+>>> server = xhotkeys.XhotkeysServer(ignore_mask)
+>>> server.executor = CallbackExecutor(workers=4, max_pending=100)
+>>> server.add_key_grab(keycode, Xlib.X.ControlMask, fetch_url, url)
+>>> server.run()
+>>> server.executor.get_stats()
+{'workers': 4, 'queued': 0, 'running': 1, 'rejected': 0, ...}
+
+Calls of the same callback are serialized (run one at a time, in order)
+unless serialize is False. When max_pending calls are waiting or running,
+new ones are rejected (and counted) instead of blocking the event loop.
+"""
+import time
+import logging
+import threading
+import collections
+
+class CallbackExecutor:
+    """Bounded pool of worker threads for callbacks."""
+
+    def __init__(self, workers=4, max_pending=100, serialize=True):
+        self.max_pending = max_pending
+        self.serialize = serialize
+        lock = threading.Lock()
+        self.condition = threading.Condition(lock)
+        self.idle = threading.Condition(lock)
+        self.ready = collections.deque()
+        self.waiting = {}
+        self.stopping = False
+        self.stats = dict(submitted=0, completed=0, rejected=0, errors=0,
+            running=0, pending=0, max_pending_seen=0)
+        self.threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._worker,
+                name="xhotkeys-worker-%d" % index)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, callback, args=(), key=None):
+        """Queue callback(*args) and return True (False if rejected).
+
+        Calls with the same key (the callback itself if None) run one at a
+        time if the executor serializes calls."""
+        if key is None:
+            key = callback
+        task = (callback, args, (key if self.serialize else None))
+        self.condition.acquire()
+        try:
+            if self.stopping or self.stats["pending"] >= self.max_pending:
+                self.stats["rejected"] += 1
+                logging.warning("callback rejected (%d pending): %r",
+                    self.stats["pending"], callback)
+                return False
+            self.stats["submitted"] += 1
+            self.stats["pending"] += 1
+            self.stats["max_pending_seen"] = max(self.stats["max_pending_seen"],
+                self.stats["pending"])
+            serial_key = task[2]
+            if serial_key is not None:
+                if serial_key in self.waiting:
+                    self.waiting[serial_key].append(task)
+                    return True
+                self.waiting[serial_key] = collections.deque()
+            self.ready.append(task)
+            self.condition.notify()
+            return True
+        finally:
+            self.condition.release()
+
+    def _worker(self):
+        """Main loop of worker threads."""
+        while 1:
+            self.condition.acquire()
+            try:
+                while not self.ready and not self.stopping:
+                    self.condition.wait()
+                if not self.ready:
+                    return
+                callback, args, serial_key = self.ready.popleft()
+                self.stats["running"] += 1
+            finally:
+                self.condition.release()
+            try:
+                callback(*args)
+                error = False
+            except Exception:
+                logging.exception("error on callback %r", callback)
+                error = True
+            self.condition.acquire()
+            try:
+                self.stats["running"] -= 1
+                self.stats["pending"] -= 1
+                self.stats["completed"] += 1
+                self.stats["errors"] += int(error)
+                if serial_key is not None:
+                    if self.waiting[serial_key]:
+                        self.ready.append(self.waiting[serial_key].popleft())
+                        self.condition.notify()
+                    else:
+                        del self.waiting[serial_key]
+                if not self.stats["pending"]:
+                    self.idle.notifyAll()
+            finally:
+                self.condition.release()
+
+    def get_stats(self):
+        """Return a dictionary with the executor statistics (queued is the
+        number of calls waiting for a worker)."""
+        self.condition.acquire()
+        try:
+            stats = dict(self.stats, workers=len(self.threads))
+        finally:
+            self.condition.release()
+        stats["queued"] = stats["pending"] - stats["running"]
+        return stats
+
+    def wait(self, timeout=None):
+        """Wait until there are no pending calls. Return True if so."""
+        deadline = (None if timeout is None else time.time() + timeout)
+        self.idle.acquire()
+        try:
+            while self.stats["pending"]:
+                if deadline is None:
+                    self.idle.wait()
+                elif time.time() >= deadline:
+                    return False
+                else:
+                    self.idle.wait(deadline - time.time())
+            return True
+        finally:
+            self.idle.release()
+
+    def shutdown(self, wait=True):
+        """Stop the workers once queued calls are done (new ones are rejected)."""
+        self.condition.acquire()
+        try:
+            self.stopping = True
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+        if wait:
+            for thread in self.threads:
+                thread.join()
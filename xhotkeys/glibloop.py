@@ -0,0 +1,71 @@
+#!/usr/bin/python2
+"""
+Dispatch XhotkeysServer events from the GLib main loop (used by GTK), so
+GTK applications can host hotkeys without a blocking loop or a thread:
+
+>>> server = xhotkeys.XhotkeysServer(ignore_mask)
+>>> server.add_key_grab(keycode, Xlib.X.ControlMask, callback)
+>>> watch = GlibWatch(server)
+>>> watch.start()
+>>> gtk.main()
+
+Other watches and timeouts of the server are not used, add them to the
+GLib main loop.
+"""
+import socket
+import logging
+
+import gobject
+import Xlib.error
+
+class GlibWatch:
+    """Watch the display of a XhotkeysServer from the GLib main loop."""
+
+    def __init__(self, server):
+        self.server = server
+        self.source_id = None
+        self.idle_id = None
+
+    def start(self):
+        """Start dispatching events."""
+        condition = gobject.IO_IN | gobject.IO_HUP | gobject.IO_ERR
+        self.source_id = gobject.io_add_watch(self.server.display.fileno(),
+            condition, self.on_display_input)
+        # Xlib may have queued events while waiting for replies
+        self.idle_id = gobject.idle_add(self.on_idle)
+
+    def running(self):
+        """Return True if events are being dispatched."""
+        return self.source_id is not None
+
+    def process_events(self):
+        """Dispatch all pending events. Return False if the connection was
+        closed (the watch is stopped)."""
+        while 1:
+            try:
+                pending_events = self.server.process_pending_events()
+            except (Xlib.error.ConnectionClosedError, socket.error), details:
+                logging.warning("connection closed: %s", details)
+                pending_events = None
+            if pending_events is None:
+                self.stop()
+                return False
+            elif not pending_events:
+                return True
+
+    def on_display_input(self, fd, condition):
+        """Called when the display connection is ready."""
+        return self.process_events()
+
+    def on_idle(self):
+        """Called once after start."""
+        self.idle_id = None
+        self.process_events()
+        return False
+
+    def stop(self):
+        """Stop dispatching events (grabs are not cleared)."""
+        for source_id in (self.source_id, self.idle_id):
+            if source_id is not None:
+                gobject.source_remove(source_id)
+        self.source_id = self.idle_id = None
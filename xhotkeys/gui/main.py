@@ -3,7 +3,7 @@ import os
 import re
 import sys
 import time
-import signal
+import socket
 import logging
 import optparse
 import subprocess
@@ -18,12 +18,14 @@ from kiwi.ui.dialogs import yesno
 import xhotkeys
 from xhotkeys import server as htserver
 from xhotkeys import misc
+from xhotkeys import control
+from xhotkeys import glibloop
 from xhotkeys.gui import gtkext
 from xhotkeys.hotkey import Hotkey
 
 # Default values
 CONFIGURATION_FILE = "~/.xhotkeysrc"
-PIDFILE = "~/.xhotkeys.pid"
+CONTROL_SOCKET = control.CONTROL_SOCKET
 ERROR, INFO, DEBUG = range(3)
 
 import Xlib.X
@@ -43,20 +45,24 @@ def get_params(form):
 class HotkeyWindow(gtk.Window):
     """Window with hotkey form.
     
-    Actions: Cancel, Save.
+    Actions: Cancel, Save, Test (grab the binding and report when it's
+    pressed, until the test button is released or the window closed).
     """     
 
-    def __init__(self, action, hotkey, hotkeys_list, pidfile, on_save):
+    def __init__(self, action, hotkey, hotkeys_list, control_socket, on_save):
         gtk.Window.__init__(self)
               
         self.hotkey = hotkey
         self.hotkeys_list = hotkeys_list
-        self.pidfile = pidfile
+        self.control_socket = control_socket
         self.on_save = on_save
-        self.display = Xlib.display.Display()
+        self.display = xhotkeys.get_display()
         
         self.form = {}
         self.recording = False
+        self.test_server = None
+        self.test_watch = None
+        self.test_count = 0
         
         # Modifiers and keycode/keysyms mappings
         modifiers_name = dict((k, v) for (k, v) 
@@ -70,13 +76,14 @@ class HotkeyWindow(gtk.Window):
         cancel_callback = self.on_hotkey_cancel__clicked
         self.set_modal(True)
         form = self.hotkey_form(hotkey, hotkeys_list, 
-            self.on_hotkey_save__clicked, cancel_callback, pidfile, action)    
+            self.on_hotkey_save__clicked, cancel_callback, action)    
         self.add(form)
         self.set_resizable(False)                    
         def on_form_window_key_press_event(window, event):
             if event.keyval == gtk.keysyms.Escape and not self.recording:
                 cancel_callback(None)
         self.connect("key-press-event", on_form_window_key_press_event)
+        self.connect("destroy", lambda window: self.stop_test())
         self.set_title("Hotkey configuration: %s" % hotkey.name)
                             
     def get_hotkey_text(self, modifiers_keycodes, keycode=None):        
@@ -137,7 +144,59 @@ class HotkeyWindow(gtk.Window):
         entry.set_text(text)
         entry.stop_emission("key-release-event")
 
+    def start_test(self, binding):
+        """Grab binding in this process and report in the test label each
+        time it's pressed. Return True if the binding could be grabbed."""
+        self.stop_test()
+        try:
+            combinations = htserver.get_binding_combinations(binding, self.display)
+        except (AttributeError, KeyError, ValueError), details:
+            self.test_label.set_text("Invalid binding: %s" % binding)
+            return False
+        self.test_server = xhotkeys.XhotkeysServer(htserver.IGNORE_MASK, 
+            display=self.display)
+        grabs = [(htserver.event_types[binding_type], code, mask, 
+            self.on_test_binding, (binding,)) 
+            for (binding_type, mask, code) in misc.uniq(combinations)]
+        if filter(None, self.test_server.set_grabs(grabs)):
+            self.stop_test()
+            names = [hotkey.name for hotkey in self.hotkeys_list 
+                if hotkey.active and hotkey.binding == binding]
+            if names:
+                self.test_label.set_text("Binding grabbed by the daemon, "
+                    "deactivate %s first" % ", ".join(names))
+            else:
+                self.test_label.set_text("Binding used by another application")
+            return False
+        self.test_watch = glibloop.GlibWatch(self.test_server)
+        self.test_watch.start()
+        self.test_count = 0
+        self.test_label.set_text("Press %s to test it" % binding)
+        return True
+
+    def stop_test(self):
+        """Release the binding grabbed by start_test (if any)."""
+        if self.test_watch:
+            self.test_watch.stop()
+            self.test_watch = None
+        if self.test_server:
+            self.test_server.set_grabs([])
+            self.test_server = None
+        
+    def on_test_binding(self, binding):
+        self.test_count += 1
+        self.test_label.set_text("%s pressed (%d)" % (binding, self.test_count))
+        
+    def on_test_button__toggled(self, test_button, entry):
+        if test_button.get_active():
+            if not self.start_test(entry.get_text()):
+                test_button.set_active(False)
+        elif self.test_server:
+            self.stop_test()
+            self.test_label.set_text("")
+
     def on_binding_button__clicked(self, record_button, entry, save_button):
+        self.test_button.set_active(False)
         self.start_recording(entry, record_button, save_button)    
         entry.connect("key-press-event", self.on_binding_entry__key_press_event, 
             record_button, save_button)
@@ -147,7 +206,7 @@ class HotkeyWindow(gtk.Window):
           self.on_binding_entry__button_press_event, record_button, save_button)
 
     def hotkey_form(self, hotkey, hotkeys_list,  
-            save_callback, cancel_callback, pidfile, action):    
+            save_callback, cancel_callback, action):    
         def attribute(name, widget_class=gtk.Entry):
             functions = {
                 gtk.Entry: [gtk.Entry.set_text, gtk.Entry.get_text],
@@ -180,16 +239,18 @@ class HotkeyWindow(gtk.Window):
         box.set_border_width(5)
         
         binding_button = gtk.Button(stock=gtk.STOCK_MEDIA_RECORD)
+        self.test_button = gtk.ToggleButton("Test")
         browse_directory_button = gtk.Button(stock=gtk.STOCK_OPEN)
         
         attributes_view = [
             ("name", gtk.Entry, {}),
             ("command", gtk.Entry, {}),
             ("binding", gtk.Entry, {"sensitive": False, 
-                                    "action": binding_button}),
-            ("directory", gtk.Entry, {"action": browse_directory_button}),
+                                    "actions": [binding_button, self.test_button]}),
+            ("directory", gtk.Entry, {"actions": [browse_directory_button]}),
             ("active", gtk.CheckButton, {}),
             ("show_osd", gtk.CheckButton, {}),
+            ("repeat", gtk.Entry, {}),
         ]
         widgets = {}
         for name, widget_class, options in attributes_view:
@@ -197,8 +258,8 @@ class HotkeyWindow(gtk.Window):
             self.form[name] = getter
             if "sensitive" in options:
                 widget.set_sensitive(options["sensitive"])
-            if "action" in options:
-                abox.pack_start(options["action"], expand=False)
+            for action_button in options.get("actions", []):
+                abox.pack_start(action_button, expand=False)
             def on_form_widget__changed(entry, name=name):
                 if name == "binding":
                     return
@@ -221,8 +282,12 @@ class HotkeyWindow(gtk.Window):
         widgets["name"].set_width_chars(40)
         binding_button.connect("clicked", self.on_binding_button__clicked, 
             widgets["binding"], save_button)
+        self.test_button.connect("toggled", self.on_test_button__toggled,
+            widgets["binding"])
         browse_directory_button.connect("clicked", 
             self.on_browse_directory__clicked, widgets["directory"])
+        self.test_label = gtk.Label()
+        box.pack_start(self.test_label)
                         
         buttons_box.pack_start(cancel_button, padding=5)
         buttons_box.pack_start(save_button, padding=5)
@@ -231,15 +296,10 @@ class HotkeyWindow(gtk.Window):
         save_button.set_sensitive(hotkey.valid(params))            
         return box
 
-    def save_hotkey(self, hotkey, params):
-        hotkey.update(params)
-        hotkey.save()
-        self.destroy()
-                    
     def on_hotkey_save__clicked(self, params, action):
         if self.hotkey.valid(params):
-            self.save_hotkey(self.hotkey, params)
-            self.on_save(self.hotkey, action)
+            if self.on_save(self.hotkey, params, action):
+                self.destroy()
 
     def on_hotkey_cancel__clicked(self, button):
         self.destroy()    
@@ -269,9 +329,9 @@ class HotkeyListWindow(gtk.Window):
     
     Actions: Edit, Delete, Add and Exit.
     """
-    def __init__(self, configfile, pidfile, icon=None):
+    def __init__(self, configfile, control_socket, icon=None):
         self.configfile = configfile
-        self.pidfile = pidfile        
+        self.control_socket = control_socket
         self.widgets = {}
         
         gtk.Window.__init__(self)
@@ -293,8 +353,14 @@ class HotkeyListWindow(gtk.Window):
         self.connect("destroy", lambda window: gtk.main_quit())
         hotkeys_list = hotkeys_list_box.object_list
         def on_cell_edited(objectlist, hotkey, attr):
-            hotkey.save()
-            self.reload_server(self.pidfile)
+            # The list has already set the new value, restore the saved one 
+            # so it's rolled back if the daemon rejects the change
+            value = getattr(hotkey, attr)
+            saved_attributes = hotkey.get_saved_attributes()
+            if saved_attributes:
+                setattr(hotkey, attr, saved_attributes[attr])
+            if not self.save_hotkey(hotkey, {attr: value}):
+                objectlist.update(hotkey)
         hotkeys_list.connect("cell-edited", on_cell_edited)
         
         def _button(stock, where, callback, *callback_args):
@@ -336,9 +402,9 @@ class HotkeyListWindow(gtk.Window):
         status = gtk.Statusbar()
         self.status = status
         box.pack_start(status, expand=False, fill=False)
-        pid = self.get_pid(pidfile)
-        if pid:
-            self.update_status("xhotkeys daemon is running (pid %d)" % pid)
+        status = self.send_request("status")
+        if status:
+            self.update_status("xhotkeys daemon is running (pid %d)" % status["pid"])
         else:
             self.update_status("xhotkeys daemon is not running")
         if icon:
@@ -349,23 +415,62 @@ class HotkeyListWindow(gtk.Window):
         context_id = self.status.get_context_id(context_description)
         self.status.push(context_id, "%s: %s" % (int(time.time()), text))
                     
-    def on_save(self, hotkeys_list, hotkey, action):
+    def on_save(self, hotkeys_list, hotkey, params, action):
+        if not self.save_hotkey(hotkey, params, action):
+            return False
         if action == "new":
             hotkeys_list.append(hotkey)
-        self.reload_server(self.pidfile)
+        else:
+            hotkeys_list.update(hotkey)
+        return True
 
-    def get_pid(self, pidfile):
-        if os.path.isfile(pidfile):
-            return int(open(pidfile).read())
-    
-    def reload_server(self, pidfile):
-        if pidfile:
-            pid = self.get_pid(pidfile)
-            if pid:
-                os.kill(pid, signal.SIGHUP)
-                self.update_status("xhotkeys daemon reloaded (pid %s)" % pid)
+    def send_request(self, command, **params):
+        """Send a request to the daemon. Return None if it's not running."""
+        if not self.control_socket:
+            return
+        try:
+            return control.send_request(self.control_socket, command, **params)
+        except socket.error, details:
+            logging.debug("cannot connect to daemon: %s" % details)
+
+    def save_hotkey(self, hotkey, params, action="edit"):
+        """Push the changes of a hotkey to the daemon, which saves them to 
+        the configuration file (the file is written here if the daemon 
+        is not running). Return True if the hotkey was saved."""
+        old_name = hotkey._name
+        old_params = dict(hotkey.get_attributes(), name=hotkey.name)
+        hotkey.update(params)
+        try:
+            if action == "new":
+                result = self.send_request("add", name=hotkey.name, 
+                    attributes=hotkey.get_attributes())
             else:
-                logging.warning("pidfile not found: %s" % pidfile)
+                result = self.send_request("update", name=old_name, 
+                    attributes=params)
+        except control.ControlError, details:
+            hotkey.update(old_params)
+            self.update_status("xhotkeys daemon error: %s" % details)
+            return False
+        if result is None:
+            hotkey.save()
+            self.update_status("hotkey saved: %s" % hotkey.name)
+            return True
+        hotkey.save(write=False)
+        if result["grabbed"]:
+            self.update_status("hotkey updated on daemon: %s" % hotkey.name)
+        else:
+            self.update_status("cannot grab binding: %s" % hotkey.binding)
+        return True
+
+    def delete_hotkey(self, hotkey):
+        """Remove hotkey from the daemon (or the configuration file if
+        it's not running)."""
+        try:
+            removed = self.send_request("remove", name=hotkey.name)
+        except control.ControlError, details:
+            logging.warning("cannot remove hotkey %s: %s" % (hotkey.name, details))
+            removed = False
+        hotkey.delete(write=not removed)
                     
     def on_hotkey_list__selected(self, hotkeys_list, hotkey, delete_button, edit_button):
         hotkeys = hotkeys_list.get_selected_rows()
@@ -382,13 +487,13 @@ class HotkeyListWindow(gtk.Window):
         self.open_hotkey_window(hotkeys_list, hotkeys[0])
 
     def open_hotkey_window(self, hotkeys_list, hotkey):        
-        window = HotkeyWindow("edit", hotkey, hotkeys_list, self.pidfile,
+        window = HotkeyWindow("edit", hotkey, hotkeys_list, self.control_socket,
             misc.partial_function(self.on_save, hotkeys_list))
         window.show_all()
 
     def on_add__clicked(self, button, hotkeys_list):
         hotkey = Hotkey(None, dict(name="name"))
-        window = HotkeyWindow("new", hotkey, hotkeys_list, self.pidfile,
+        window = HotkeyWindow("new", hotkey, hotkeys_list, self.control_socket,
             misc.partial_function(self.on_save, hotkeys_list))
         window.show_all()
         
@@ -401,9 +506,10 @@ class HotkeyListWindow(gtk.Window):
         response = yesno(warning, parent=self, default=gtk.RESPONSE_NO)        
         if response == gtk.RESPONSE_YES:
             for hotkey in hotkeys:
-                hotkey.delete()
+                self.delete_hotkey(hotkey)
                 hotkeys_list.remove(hotkey)
-            self.reload_server(self.pidfile)
+            self.update_status("hotkeys deleted: %s" % 
+                ", ".join(x.name for x in hotkeys))
 
     def on_quit__clicked(self, button):
         gtk.main_quit()
@@ -426,21 +532,23 @@ def main(args):
         action="count", help='Increase verbose level (maximum: 3)')
     parser.add_option('-c', '--config-file', dest='cfile', default=None, 
         metavar='FILE', type='string', help='Alternative configuration file')        
-    parser.add_option('-p', '--pid-file', dest='pidfile', default=None, 
-        metavar='FILE', type='string', help='Alternative pidfile')
+    parser.add_option('-s', '--control-socket', dest='control_socket', 
+        default=None, metavar='FILE', type='string', 
+        help='Alternative daemon control socket')
                 
     options, args = parser.parse_args(args)
     misc.set_verbose_level(options.verbose_level) 
            
     # Get absolute path for the files as current directory is likely to change
     configfile = os.path.expanduser(options.cfile or CONFIGURATION_FILE)
-    pidfile = os.path.abspath(os.path.expanduser(options.pidfile or PIDFILE))
+    control_socket = os.path.abspath(os.path.expanduser(
+        options.control_socket or CONTROL_SOCKET))
     directories = ["/usr/local/share/xhotkeys", "/usr/share/xhotkeys"]
     if os.path.basename(__file__) == "main.py": # development 
         directories.insert(0, "pics")
     directory = first(d for d in directories if os.path.isdir(d))
     icon = (os.path.join(directory, "xhotkeys.xpm") if directory else None)
-    window = HotkeyListWindow(configfile, pidfile, icon)    
+    window = HotkeyListWindow(configfile, control_socket, icon)    
     window.show_all()
     window.resize(900, 500)
     gtk.main()
@@ -1,6 +1,15 @@
 #!/usr/bin/python2
+import os
+import types
+import hashlib
+import marshal
+import logging
+
 import configobj
 
+# Version of the snapshot format (see ConfigObjModel.init)
+SNAPSHOT_VERSION = 1
+
 def string2bool(s):
     if isinstance(s, bool):
         return s
@@ -10,13 +19,46 @@ def strtype2type(s):
   info = {
     "string": str,
     "boolean": bool,
+    "integer": int,
   }
   return info[s]
 
+def convert_value(options, value):
+    """Convert value to the type of an attribute (from its options)."""
+    if options["type"] == "boolean":
+        return string2bool(value)
+    elif options["type"] == "integer":
+        return int(value or 0)
+    return value
+
+def get_file_stat(path):
+    """Return a tuple (mtime, size) for path (None if it does not exist)."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+def read_file(path):
+    """Return the contents of path (None if not readable)."""
+    try:
+        fd = open(path, "rb")
+        try:
+            return fd.read()
+        finally:
+            fd.close()
+    except IOError:
+        return None
+
 class ConfigObjModel:
     """Generic model for configobj back-end"""
     name_attribute = "name"
     attributes = {}
+    config = None
+    configfile = None
+    config_data = None
+    config_stat = None
+    snapshot = None
     
     def __init__(self, name, opts={}):
         self._name = name
@@ -30,26 +72,132 @@ class ConfigObjModel:
             if attr != self.name_attribute and attr not in self.attributes:
                 raise ValueError, "Attribute unknown: %s" % attr
             if attr in self.attributes:
-                options = self.attributes[attr]
-                if options["type"] == "boolean":
-                    value = string2bool(value)
+                try:
+                    value = convert_value(self.attributes[attr], value)
+                except (TypeError, ValueError, AttributeError):
+                    # Do not let a bad value abort loading the configuration
+                    logging.warning("invalid value for %s of %s: %r", 
+                        attr, self._name, value)
+                    continue
             setattr(self, attr, value)
 
     @classmethod    
-    def init(cls, configfile):
-        cls.config = configobj.ConfigObj(configfile)        
+    def init(cls, configfile, snapshot=None):
+        """Use configfile (a path or a file object), parsed on first use. 
+        
+        If snapshot (a path) is given, items are loaded from there while it's
+        up to date with configfile (same mtime and size, or same contents), 
+        and it's written when configfile has to be parsed."""
+        cls.configfile = configfile
+        cls.snapshot = (snapshot if isinstance(configfile, basestring) else None)
+        cls.config = None
+        cls.config_data = None
+    
+    @classmethod    
+    def get_config(cls):
+        """Return the configobj.ConfigObj object (parsed on first call)."""
+        if cls.config is None:
+            if cls.snapshot:
+                cls.config_stat = get_file_stat(cls.configfile)
+                cls.config_data = read_file(cls.configfile)
+            if cls.config_data is None:
+                cls.config = configobj.ConfigObj(cls.configfile)
+            else:
+                cls.config = configobj.ConfigObj(cls.config_data.splitlines())
+                cls.config.filename = cls.configfile
+        return cls.config
     
     @classmethod    
     def items(cls):        
-        return [cls(name, opts) for (name, opts) in cls.config.items()]
+        if cls.snapshot:
+            items = cls.load_snapshot()
+            if items is not None:
+                return items
+        # An already parsed config may have unsaved changes (save(write=False))
+        parsed = (cls.config is None)
+        items = [cls(name, opts) for (name, opts) in cls.get_config().items()]
+        if parsed and cls.snapshot and cls.config_data is not None:
+            cls.save_snapshot(items, cls.config_stat, 
+                hashlib.md5(cls.config_data).hexdigest())
+        return items
+
+    @classmethod
+    def get_snapshot_version(cls):
+        """Return the version of snapshots (changes with the attributes)."""
+        return (SNAPSHOT_VERSION, cls.name_attribute, sorted(cls.attributes))
+
+    @classmethod
+    def load_snapshot(cls):
+        """Return the items stored in the snapshot (None if not up to date).
+        
+        Instances are created from the stored records without calling 
+        __init__ (values were already converted)."""
+        stat = get_file_stat(cls.configfile)
+        data = read_file(cls.snapshot)
+        if stat is None or data is None:
+            return
+        try:
+            snapshot = marshal.loads(data)
+            version, snapshot_stat, digest, records = snapshot
+        except (EOFError, ValueError, TypeError):
+            logging.warning("invalid configuration snapshot: %s", cls.snapshot)
+            return
+        if version != list(cls.get_snapshot_version()):
+            return
+        if tuple(snapshot_stat) != stat:
+            contents = read_file(cls.configfile)
+            if contents is None or hashlib.md5(contents).hexdigest() != digest:
+                return
+            snapshot[1] = stat
+            cls.write_snapshot(snapshot)
+        version, name_attribute, attributes = version
+        names = ["_name", name_attribute] + attributes
+        instance = types.InstanceType
+        return [instance(cls, dict(zip(names, (record[0],) + record)))
+            for record in records]
+
+    @classmethod
+    def save_snapshot(cls, items, stat, digest):
+        """Write the snapshot of items (read from a configfile with stat and 
+        MD5 digest)."""
+        version = cls.get_snapshot_version()
+        attributes = [version[1]] + version[2]
+        records = [tuple(getattr(item, attr) for attr in attributes) 
+            for item in items]
+        cls.write_snapshot([list(version), stat, digest, records])
+
+    @classmethod
+    def write_snapshot(cls, snapshot):
+        """Write snapshot data atomically."""
+        tempfile = cls.snapshot + ".tmp"
+        try:
+            fd = open(tempfile, "wb")
+            try:
+                marshal.dump(snapshot, fd)
+            finally:
+                fd.close()
+            os.rename(tempfile, cls.snapshot)
+        except (IOError, OSError), details:
+            logging.warning("cannot write configuration snapshot %s: %s", 
+                cls.snapshot, details)
 
     def get_attributes(self):
         return dict((attr, getattr(self, attr)) for attr in self.attributes)
             
+    def get_saved_attributes(self):
+        """Return the attributes as saved in the configuration (None if the
+        item was not saved)."""
+        config = self.get_config()
+        if not self._name or self._name not in config.sections:
+            return None
+        return self.__class__(self._name, config[self._name]).get_attributes()
+
     def update(self, params):
         for attr, value in params.iteritems():
             if attr != self.name_attribute and attr not in self.attributes:
                 raise ValueError, "Attribute unknown: %s" % attr
+            if attr in self.attributes:
+                value = convert_value(self.attributes[attr], value)
             setattr(self, attr, value) 
         
     def valid(self, params=None, attribute=None):
@@ -62,7 +210,7 @@ class ConfigObjModel:
             if not params[self.name_attribute]:
                 return False
             if self._name != params[self.name_attribute] and \
-                    params[self.name_attribute] in self.__class__.config.sections:
+                    params[self.name_attribute] in self.get_config().sections:
                 return False
             if attribute == self.name_attribute:
                 return True
@@ -76,24 +224,33 @@ class ConfigObjModel:
             if not self.attributes[key].get("void", True):
                 if not value:
                     return False
+            if self.attributes[key]["type"] == "integer":
+                try:
+                    convert_value(self.attributes[key], value)
+                except (TypeError, ValueError):
+                    return False
         return True
                          
-    def save(self):
+    def save(self, write=True):
         if not self.valid():
             raise ValueError, "Validation failed"
         new_attributes = dict((attr, getattr(self, attr)) 
             for attr in self.attributes)
         name_value = getattr(self, self.name_attribute)
+        config = self.get_config()
         if self._name != name_value:
             if self._name:
-                self.__class__.config.rename(self._name, name_value )
+                config.rename(self._name, name_value )
             self._name = name_value
-        self.__class__.config[self._name] = new_attributes
-        self.__class__.config.write()
+        config[self._name] = new_attributes
+        if write:
+            config.write()
         
-    def delete(self):
-        del self.__class__.config[self.name]
-        self.__class__.config.write()
+    def delete(self, write=True):
+        config = self.get_config()
+        del config[self.name]
+        if write:
+            config.write()
 
 class Hotkey(ConfigObjModel):
     """Model for hotkey item"""
@@ -104,6 +261,10 @@ class Hotkey(ConfigObjModel):
         "directory": dict(type="string", default="~"),
         "show_osd": dict(type="boolean", default=False),
         "active": dict(type="boolean", default=True),
+        "repeat": dict(type="string", default="once"),
+        "single_instance": dict(type="boolean", default=False),
+        "max_instances": dict(type="integer", default=0),
+        "instance_signal": dict(type="string", default=""),
     }
     
     def __repr__(self):
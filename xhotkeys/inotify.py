@@ -0,0 +1,109 @@
+#!/usr/bin/python2
+"""
+Minimal interface to Linux inotify (using ctypes).
+
+The object can be passed to select, events are read when it's ready:
+
+>>> notifier = Inotify()
+>>> notifier.add_watch("/home/user", IN_CLOSE_WRITE | IN_MOVED_TO)
+1
+>>> notifier.read_events()
+[(1, 8, 0, '.xhotkeys')]
+
+Events are tuples (watch_descriptor, mask, cookie, name).
+"""
+import os
+import errno
+import struct
+import ctypes
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+IN_CLOEXEC = 02000000
+IN_NONBLOCK = 04000
+
+EVENT_HEADER = "iIII"
+EVENT_HEADER_SIZE = struct.calcsize(EVENT_HEADER)
+
+_libc = None
+
+def get_libc():
+    """Return the C library (loaded on first use)."""
+    global _libc
+    if _libc is None:
+        # The symbols of the process (linked with libc), ctypes.util is not 
+        # used: it imports subprocess and runs ldconfig to find libraries
+        _libc = ctypes.CDLL(None, use_errno=True)
+    return _libc
+
+def check_call(result):
+    """Raise OSError (with errno) if result of a libc call is negative."""
+    if result < 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+    return result
+
+def parse_events(data):
+    """Return the list of events in a buffer read from an inotify descriptor."""
+    events = []
+    offset = 0
+    while offset + EVENT_HEADER_SIZE <= len(data):
+        wd, mask, cookie, length = \
+            struct.unpack_from(EVENT_HEADER, data, offset)
+        offset += EVENT_HEADER_SIZE
+        name = data[offset:offset+length].rstrip("\0")
+        offset += length
+        events.append((wd, mask, cookie, name))
+    return events
+
+class Inotify:
+    """Inotify instance (raise OSError if not available)."""
+
+    def __init__(self):
+        try:
+            libc = get_libc()
+            inotify_init1 = libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, "inotify not available")
+        self.fd = check_call(inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    def fileno(self):
+        """Return the inotify file descriptor."""
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """Watch path for events in mask and return the watch descriptor."""
+        return check_call(get_libc().inotify_add_watch(self.fd, path, mask))
+
+    def rm_watch(self, wd):
+        """Remove watch descriptor."""
+        check_call(get_libc().inotify_rm_watch(self.fd, wd))
+
+    def read_events(self):
+        """Return all available events."""
+        chunks = []
+        while 1:
+            try:
+                chunks.append(os.read(self.fd, 65536))
+            except OSError, details:
+                if details.errno == errno.EINTR:
+                    continue
+                if details.errno != errno.EAGAIN:
+                    raise
+                return parse_events("".join(chunks))
+
+    def close(self):
+        """Close the inotify descriptor (all watches are removed)."""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
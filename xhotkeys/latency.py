@@ -0,0 +1,110 @@
+#!/usr/bin/python2
+"""
+Latency instrumentation for the keypress to launch pipeline.
+
+The recorder keeps a rolling window of samples for each stage (and for each
+hotkey), all measured in milliseconds for the event being processed:
+
+  - delivery: from the X server timestamp to the dequeue in the daemon.
+  - match: from the dequeue to the hotkey matched in the combinations trie.
+  - launch: from the dequeue to the command started (or sent to the
+    launcher helper).
+
+>>> recorder = LatencyRecorder()
+>>> recorder.start_event(event.time)
+>>> recorder.record("match", "terminal")
+>>> recorder.get_report()
+{'match': {'count': 1, 'p50': 0.1, 'p95': 0.1, 'p99': 0.1, 'max': 0.1},
+ 'hotkeys': {'terminal': {'match': {...}}}}
+
+X timestamps are milliseconds in the server clock, the offset to the local
+clock is estimated as the minimum difference seen (so delivery latencies
+are relative to the fastest delivery observed).
+"""
+import time
+import collections
+
+PERCENTILES = [50, 95, 99]
+# Number of samples kept for each histogram
+WINDOW_SIZE = 1000
+# Maximum change of the clock offset (ms) before estimating it again
+MAX_OFFSET_JUMP = 60 * 60 * 1000
+
+class RollingHistogram:
+    """Percentiles of the last size samples."""
+
+    def __init__(self, size=WINDOW_SIZE):
+        self.samples = collections.deque(maxlen=size)
+        self.count = 0
+
+    def add(self, value):
+        """Add a sample."""
+        self.samples.append(value)
+        self.count += 1
+
+    def percentile(self, percent, sorted_samples=None):
+        """Return the percentile of samples (None if there are no samples)."""
+        if sorted_samples is None:
+            sorted_samples = sorted(self.samples)
+        if not sorted_samples:
+            return
+        index = int(round((len(sorted_samples) - 1) * percent / 100.0))
+        return sorted_samples[index]
+
+    def get_summary(self):
+        """Return a dictionary with count, max and percentiles (pNN)."""
+        sorted_samples = sorted(self.samples)
+        summary = dict(count=self.count,
+            max=(sorted_samples[-1] if sorted_samples else None))
+        for percent in PERCENTILES:
+            summary["p%d" % percent] = self.percentile(percent, sorted_samples)
+        return summary
+
+class LatencyRecorder:
+    """Record stage latencies of events, globally and per hotkey."""
+
+    def __init__(self, size=WINDOW_SIZE):
+        self.size = size
+        self.stages = {}
+        self.hotkeys = {}
+        self.clock_offset = None
+        self.event_start = None
+
+    def get_histogram(self, stage, name=None):
+        """Return the histogram for stage (of hotkey name if given)."""
+        histograms = (self.stages if name is None else
+            self.hotkeys.setdefault(name, {}))
+        if stage not in histograms:
+            histograms[stage] = RollingHistogram(self.size)
+        return histograms[stage]
+
+    def start_event(self, xtime=None):
+        """Start measuring an event dequeued now (xtime: X server timestamp)."""
+        self.event_start = now = time.time()
+        if xtime is None:
+            return
+        offset = now * 1000.0 - xtime
+        if (self.clock_offset is None or offset < self.clock_offset or
+                offset - self.clock_offset > MAX_OFFSET_JUMP):
+            self.clock_offset = offset
+        self.get_histogram("delivery").add(offset - self.clock_offset)
+
+    def record(self, stage, name=None):
+        """Record the time since the current event was dequeued for stage
+        (also for the hotkey if name is given)."""
+        if self.event_start is None:
+            return
+        elapsed = (time.time() - self.event_start) * 1000.0
+        self.get_histogram(stage).add(elapsed)
+        if name is not None:
+            self.get_histogram(stage, name).add(elapsed)
+
+    def get_report(self):
+        """Return the summaries for each stage, and for each hotkey in
+        the hotkeys key: {stage: summary, "hotkeys": {name: {stage: summary}}}."""
+        report = dict((stage, histogram.get_summary())
+            for (stage, histogram) in self.stages.iteritems())
+        report["hotkeys"] = dict((name, dict((stage, histogram.get_summary())
+            for (stage, histogram) in histograms.iteritems()))
+            for (name, histograms) in self.hotkeys.iteritems())
+        return report
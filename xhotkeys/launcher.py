@@ -0,0 +1,287 @@
+#!/usr/bin/python2
+"""
+Launch commands from a small helper process (a fork server).
+
+The helper is forked when the daemon starts, while it's still small, and
+receives launch requests through a pipe. The daemon does not need to fork
+itself on every hotkey and returns immediately to its event loop. Results
+are read from the launcher file descriptor (it can be passed to select):
+
+>>> launcher = ForkServerLauncher()
+>>> launcher.start()
+>>> launcher.launch("xterm", directory="/tmp")
+1
+>>> launcher.read_responses()
+[("started", 1, 12345)]
+
+Responses are tuples: ("started", launch_id, pid), ("error", launch_id,
+error_string) and ("exited", pid, status). Commands without shell
+metacharacters or builtins are executed directly, skipping /bin/sh (it's
+still used for scripts without a #! line, as execvp does in C).
+"""
+import os
+import errno
+import fcntl
+import struct
+import signal
+import cPickle as pickle
+
+import xhotkeys
+
+# Characters that need a shell to run a command string
+SHELL_CHARACTERS = set("~`!#$&*()|\\;'\"<>?[]{}=\n")
+# Shell builtins that have no executable
+SHELL_BUILTINS = set([".", ":", "alias", "break", "cd", "continue", "eval", 
+    "exec", "exit", "export", "read", "readonly", "return", "set", "shift", 
+    "source", "times", "trap", "ulimit", "umask", "unalias", "unset", "wait"])
+
+def set_cloexec(fd):
+    """Set close-on-exec flag on file descriptor."""
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+def set_nonblocking(fd):
+    """Set non-blocking flag on file descriptor."""
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+def get_command_args(command, shell=True):
+    """Return the arguments to execute command (/bin/sh is used only if needed).
+    
+    Raise ValueError if the command is empty."""
+    if not isinstance(command, basestring):
+        args = list(command)
+    else:
+        args = command.split()
+        if shell and args and (SHELL_CHARACTERS.intersection(command) or 
+                args[0] in SHELL_BUILTINS):
+            args = ["/bin/sh", "-c", command]
+    if not args:
+        raise ValueError("empty command")
+    return args
+
+def spawn(args, directory=None, environment=None):
+    """Fork and execute args (in directory, with variables in environment 
+    updated) and return the pid of the child.
+
+    Raise OSError if the command could not be executed."""
+    errpipe_read, errpipe_write = os.pipe()
+    set_cloexec(errpipe_write)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(errpipe_read)
+            if directory:
+                os.chdir(directory)
+            if environment:
+                os.environ.update(environment)
+            try:
+                os.execvp(args[0], args)
+            except OSError, details:
+                if details.errno != errno.ENOEXEC:
+                    raise
+                # Not an executable format: a script without #!, run it 
+                # with the shell (it searches the PATH again)
+                os.execv("/bin/sh", ["/bin/sh", "-c", '"$0" "$@"'] + list(args))
+        except OSError, details:
+            os.write(errpipe_write, "%d:%s" % (details.errno, details.strerror))
+        finally:
+            os._exit(127)
+    os.close(errpipe_write)
+    try:
+        data = read_all(errpipe_read)
+    finally:
+        os.close(errpipe_read)
+    if data:
+        os.waitpid(pid, 0)
+        errno_value, strerror = data.split(":", 1)
+        raise OSError(int(errno_value), strerror)
+    return pid
+
+def read_all(fd):
+    """Read from file descriptor until EOF."""
+    chunks = []
+    while 1:
+        try:
+            data = os.read(fd, 4096)
+        except OSError, details:
+            if details.errno == errno.EINTR:
+                continue
+            raise
+        if not data:
+            return "".join(chunks)
+        chunks.append(data)
+
+def read_available(fd):
+    """Read all available data from a non-blocking file descriptor.
+
+    Return None if the end of file was reached."""
+    chunks = []
+    while 1:
+        try:
+            data = os.read(fd, 65536)
+        except OSError, details:
+            if details.errno == errno.EINTR:
+                continue
+            if details.errno != errno.EAGAIN:
+                raise
+            return "".join(chunks)
+        if not data:
+            return ("".join(chunks) if chunks else None)
+        chunks.append(data)
+
+def write_message(fd, message):
+    """Write a message (any pickable object) to file descriptor."""
+    data = pickle.dumps(message, 2)
+    data = struct.pack("!I", len(data)) + data
+    while data:
+        try:
+            written = os.write(fd, data)
+        except OSError, details:
+            if details.errno == errno.EINTR:
+                continue
+            raise
+        data = data[written:]
+
+class MessageReader:
+    """Decode messages written with write_message from chunks of data."""
+    header_size = struct.calcsize("!I")
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, data):
+        """Add data and return the list of completed messages."""
+        self.buffer += data
+        messages = []
+        while len(self.buffer) >= self.header_size:
+            size, = struct.unpack("!I", self.buffer[:self.header_size])
+            end = self.header_size + size
+            if len(self.buffer) < end:
+                break
+            messages.append(pickle.loads(self.buffer[self.header_size:end]))
+            self.buffer = self.buffer[end:]
+        return messages
+
+def reap_children(responses_fd):
+    """Wait for all finished children and report their exit status."""
+    while 1:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except OSError, details:
+            if details.errno == errno.EINTR:
+                continue
+            if details.errno != errno.ECHILD:
+                raise
+            return
+        if not pid:
+            return
+        write_message(responses_fd, ("exited", pid, status))
+
+def run_helper(requests_fd, responses_fd):
+    """Main loop of the helper process: run requested commands and report
+    their pids and exit status. Return when the requests pipe is closed."""
+    wakeup_read, wakeup_write = os.pipe()
+    for fd in (wakeup_read, wakeup_write):
+        set_cloexec(fd)
+        set_nonblocking(fd)
+    for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, signal.SIG_DFL)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.set_wakeup_fd(wakeup_write)
+    reader = MessageReader()
+    while 1:
+        ready = xhotkeys.wait_for_input([requests_fd, wakeup_read])
+        if wakeup_read in ready:
+            read_available(wakeup_read)
+            reap_children(responses_fd)
+        if requests_fd not in ready:
+            continue
+        data = os.read(requests_fd, 65536)
+        if not data:
+            break
+        for name, launch_id, args, directory, environment in reader.feed(data):
+            try:
+                pid = spawn(args, directory, environment)
+            except OSError, details:
+                write_message(responses_fd, ("error", launch_id, str(details)))
+            else:
+                write_message(responses_fd, ("started", launch_id, pid))
+
+class ForkServerLauncher:
+    """Run commands from a helper process forked on start."""
+
+    def __init__(self):
+        self.pid = None
+        self.requests_fd = None
+        self.responses_fd = None
+        self.reader = MessageReader()
+        self.last_launch_id = 0
+
+    def start(self):
+        """Fork the helper process."""
+        requests_read, requests_write = os.pipe()
+        responses_read, responses_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(requests_write)
+                os.close(responses_read)
+                for fd in (requests_read, responses_write):
+                    set_cloexec(fd)
+                run_helper(requests_read, responses_write)
+            finally:
+                os._exit(0)
+        os.close(requests_read)
+        os.close(responses_write)
+        for fd in (requests_write, responses_read):
+            set_cloexec(fd)
+        set_nonblocking(responses_read)
+        self.pid = pid
+        self.requests_fd = requests_write
+        self.responses_fd = responses_read
+
+    def running(self):
+        """Return True if the helper process is running."""
+        return self.pid is not None
+
+    def fileno(self):
+        """Return the file descriptor where responses are read from."""
+        return self.responses_fd
+
+    def launch(self, command, directory=None, shell=True, environment=None):
+        """Ask the helper to run command in directory (with variables in
+        environment updated) and return the launch id.
+
+        The pid of the process is reported later by read_responses. Raise 
+        ValueError if the command is empty."""
+        if not self.running():
+            raise OSError(errno.ESRCH, "launcher helper not running")
+        self.last_launch_id += 1
+        args = get_command_args(command, shell)
+        write_message(self.requests_fd,
+            ("launch", self.last_launch_id, args, directory, environment))
+        return self.last_launch_id
+
+    def read_responses(self):
+        """Return the list of available responses from the helper process."""
+        if not self.running():
+            return []
+        data = read_available(self.responses_fd)
+        if data is None:
+            self.stop()
+            return []
+        return self.reader.feed(data)
+
+    def stop(self):
+        """Stop the helper process (running commands are not killed)."""
+        if not self.running():
+            return
+        os.close(self.requests_fd)
+        os.close(self.responses_fd)
+        try:
+            os.waitpid(self.pid, 0)
+        except OSError, details:
+            if details.errno != errno.ECHILD:
+                raise
+        self.pid = self.requests_fd = self.responses_fd = None
@@ -4,6 +4,7 @@ General-use functions and classes.
 """
 import sys
 import logging
+import collections
 
 VERBOSE_LEVELS = {
     0: logging.CRITICAL,
@@ -38,18 +39,46 @@ def flatten(it):
     """Flatten iterator content (only first level nesting)"""
     return [x for y in it for x in y]
         
-def set_verbose_level(verbose_level):
+def get_logging_level(verbose_level):
+    """Return the logging level for verbose_level (see VERBOSE_LEVELS)."""
+    return VERBOSE_LEVELS[max(0, min(verbose_level, len(VERBOSE_LEVELS)-1))]
+
+def set_verbose_level(verbose_level, ring_buffer=None):
     """Set verbose level for logging.
     
-    See VERBOSE_LEVELS constant for allowed values."""
-    nlevel = max(0, min(verbose_level, len(VERBOSE_LEVELS)-1))
-    logging.basicConfig(level=VERBOSE_LEVELS[nlevel], stream=sys.stderr,  
+    See VERBOSE_LEVELS constant for allowed values. If a ring_buffer handler 
+    is given (see RingBufferHandler), it's added to the root logger and
+    receives records of its own level whatever the verbose level."""
+    level = get_logging_level(verbose_level)
+    logging.basicConfig(level=level, stream=sys.stderr,  
         format='%(levelname)s: %(message)s')
+    if ring_buffer:
+        for handler in logging.root.handlers:
+            handler.setLevel(level)
+        logging.root.addHandler(ring_buffer)
+        logging.root.setLevel(min(level, ring_buffer.level))
 
 def compact(it, pred=bool):
     """Filter elements in iterable that do not match predicate."""
     return filter(pred, it)
                       
+class RingBufferHandler(logging.Handler):
+    """Logging handler that keeps the last records in memory.
+    
+    Records are formatted only when requested (see get_lines)."""
+    def __init__(self, capacity=1000, level=logging.DEBUG):
+        logging.Handler.__init__(self, level)
+        self.records = collections.deque(maxlen=capacity)
+        self.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s: %(message)s'))
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def get_lines(self):
+        """Return the formatted records (oldest first)."""
+        return [self.format(record) for record in list(self.records)]
+
 class Struct:
     """Struct/record-like class."""
     def __init__(self, name, **entries):
@@ -31,30 +31,40 @@ import os
 import re
 import sys
 import time
-import shlex
 import signal
+import marshal
+import hashlib
+import socket
 import logging
-import inspect
 import optparse
-import subprocess
 
 # Third-party mdoules
 import Xlib
 from Xlib import X 
-try:
-    import pyosd
-    pyosdobj = pyosd.osd(lines=2)
-except ImportError:
-    pyosdobj = None
 
 # Application modules
 import xhotkeys
 from xhotkeys import misc
-from xhotkeys.hotkey import Hotkey
+from xhotkeys.hotkey import Hotkey, convert_value
+from xhotkeys.supervisor import ChildSupervisor
 
 # Global values
 VERSION = "0.1.3"
 CONFIGURATION_FILE = "~/.xhotkeysrc"
+BINDINGS_CACHE_FILE = "~/.xhotkeys.cache"
+BINDINGS_CACHE_SIZE = 4
+# Suffix of the compiled snapshot of the configuration file (see get_config)
+CONFIG_SNAPSHOT_SUFFIX = ".snapshot"
+# Time (in seconds) to wait for the configuration file to settle before reloading
+CONFIG_RELOAD_DELAY = 0.3
+# Number of recent log records (of all levels) kept in memory
+LOG_BUFFER_SIZE = 1000
+KEYSYMS_PER_KEYCODE = 8
+# Modifiers ignored by xhotkeyd (locks)
+IGNORE_MASK = X.LockMask | X.Mod2Mask | X.Mod3Mask | X.Mod5Mask
+
+# Global OSD object: None if not created yet, False if pyosd is not available
+pyosdobj = None
 
 modifiers_name = {
     X.ShiftMask: "Shift",
@@ -69,92 +79,312 @@ modifiers_name = {
 
 modifiers_masks = dict((v.lower(), k) for (k, v) in modifiers_name.items())
 
+event_types = {
+    "keyboard": X.KeyPress,
+    "mouse": X.ButtonPress,
+}
+
 class XhotkeysServerReload(Exception):
     """Raised when the configuration must be reload."""
     pass
         
 def on_terminate(server, signum, frame):
     """Called when the process is asked to terminate."""
-    logging.debug("on_terminate: signum=%s, frame=%s" % (signum, frame))
+    logging.debug("on_terminate: signum=%s, frame=%s", signum, frame)
     logging.info("clearing all X grabs")        
-    server.clear_grabs()
+    for server0 in [server] + server.servers:
+        server0.clear_grabs()
+        server0.display.flush()
     logging.info("exiting...")
     sys.exit()
         
 def on_sigchild(signum, frame):
-    """Called when a child process ends."""
-    logging.debug("on_sigchild: signum=%s, frame=%s" % (signum, frame))    
-    pid, returncode = os.wait()
-    logging.info("process %d terminated (return code %s)" % (pid, returncode))
+    """Called when a child process ends. 
+    
+    Nothing is done here, the signal wakes up the main loop through the 
+    wakeup file descriptor and children are reaped there (see on_wakeup)."""
+    pass
+
+def on_wakeup(fd, supervisor):
+    """Called when a signal has been received: reap finished children."""
+    from xhotkeys.launcher import read_available
+    read_available(fd)
+    supervisor.reap()
+
+def create_wakeup_fd():
+    """Create a pipe written on signals (see signal.set_wakeup_fd) and return
+    its reading end."""
+    from xhotkeys.launcher import set_cloexec, set_nonblocking
+    fdr, fdw = os.pipe()
+    for fd in (fdr, fdw):
+        set_cloexec(fd)
+        set_nonblocking(fd)
+    signal.set_wakeup_fd(fdw)
+    return fdr
 
 def on_sighup(signum, frame):
     """Called when a SIGHUP signal is received. Reload configuration"""
-    logging.debug("on_sighup: signum=%s, frame=%s" % (signum, frame))
+    logging.debug("on_sighup: signum=%s, frame=%s", signum, frame)
     logging.info("reload exception raised")
     raise XhotkeysServerReload
 
+def get_osd():
+    """Return global OSD object, created on first use (None if not available)."""
+    global pyosdobj
+    if pyosdobj is None:
+        try:
+            import pyosd
+        except ImportError:
+            logging.warning("pyosd module not found, OSD disabled")
+            pyosdobj = False
+        else:
+            pyosdobj = pyosd.osd(lines=2)
+            pyosdobj.set_pos(pyosd.POS_MID)
+            pyosdobj.set_align(pyosd.ALIGN_CENTER)
+            pyosdobj.set_colour("#FF0000")
+            pyosdobj.set_timeout(1)
+            pyosdobj.set_shadow_offset(2)
+            pyosdobj.set_font("-*-times-*-r-*-*-*-200-*-*-*-*-*-*")
+    return pyosdobj or None
+    
 def show_osd(*lines):
     """Show lines in global OSD object."""
-    if not pyosdobj:
+    osd = get_osd()
+    if not osd:
         return
-    pyosdobj.set_pos(pyosd.POS_MID)
-    pyosdobj.set_align(pyosd.ALIGN_CENTER)
-    pyosdobj.set_colour("#FF0000")
-    pyosdobj.set_timeout(1)
-    pyosdobj.set_shadow_offset(2)
-    pyosdobj.set_font("-*-times-*-r-*-*-*-200-*-*-*-*-*-*")
     for index, line in enumerate(lines):
-        pyosdobj.display(line, line=index)
+        osd.display(line, line=index)
        
-def on_hotkey(state, dcombinations, combination):
+def build_combinations_trie(dcombinations):
+    """
+    Return a prefix tree from a dictionary {hotkey: combinations}.
+    
+    Each node is a dictionary {combination: (hotkey, children)}, where 
+    hotkey is the hotkey whose sequence ends in that combination (or None) 
+    and children is the next node (empty if no longer sequence follows).
     """
-    Callback run with a combination is detected.
+    trie = {}
+    for hotkey, combinations in dcombinations.iteritems():
+        if not combinations:
+            continue
+        node = trie
+        for combination in combinations[:-1]:
+            hotkey0, children = node.setdefault(combination, (None, {}))
+            node = children
+        hotkey0, children = node.get(combinations[-1], (None, {}))
+        if hotkey0 is not None:
+            logging.warning("hotkeys with the same binding: %s, %s", 
+                hotkey0.name, hotkey.name)
+        node[combinations[-1]] = (hotkey, children)
+    return trie
+
+def get_hotkey_directory(hotkey):
+    """Return expanded directory for hotkey (None if not set or not valid)."""
+    if not hotkey.directory:
+        return
+    directory = os.path.abspath(os.path.expanduser(hotkey.directory))
+    if not os.path.isdir(directory):
+        logging.warning("directory not found for hotkey %s: %s", 
+            hotkey.name, directory)
+        return
+    return directory
     
-    It searches configured combinations to determine which hotkeys is refering.
+def reset_combination_state(state):
+    """Start a new combination on the state used by on_hotkey."""
+    state.node = state.trie
+    state.timeout = None
+    
+def get_repeat_interval(hotkey):
+    """Return the minimum interval (seconds) between auto-repeated runs of 
+    hotkey from its repeat policy: "once" (None, auto-repeat is ignored), 
+    "repeat" (0.0, run on every repeat) or a maximum number of runs per 
+    second."""
+    policy = hotkey.repeat.strip().lower()
+    if policy in ("", "once"):
+        return
+    elif policy == "repeat":
+        return 0.0
+    try:
+        rate = float(policy)
+    except ValueError:
+        rate = 0
+    if rate <= 0:
+        logging.warning("invalid repeat policy for hotkey %s: %s", 
+            hotkey.name, hotkey.repeat)
+        return
+    return 1.0 / rate
+
+def on_hotkey_repeat(state, combination, screen=0):
+    """Called for an auto-repeated combination: run the last hotkey run 
+    again if it was triggered by the same combination and its repeat 
+    policy allows it."""
+    if not state.last_run or state.last_run[0] != combination:
+        return
+    combination, hotkey, last_time = state.last_run
+    interval = state.repeat_intervals.get(hotkey)
+    now = time.time()
+    if interval is None or now - last_time < interval:
+        return
+    state.last_run = (combination, hotkey, now)
+    run_hotkey(state, hotkey, screen)
+
+def on_hotkey(state, combination, repeat=False, screen=0):
+    """
+    Callback run with a combination is detected (repeat is True for an
+    auto-repeated key press, screen is the screen number where it was 
+    pressed, see XhotkeysServer.pass_event_info).
+    
+    It walks a step down the combinations trie (see build_combinations_trie) 
+    from the current node: if there are longer sequences it waits for the 
+    next combination, if a hotkey sequence ends there it's run, otherwise 
+    the combination is reset. Auto-repeated key presses do not walk the 
+    trie, they are handled by on_hotkey_repeat.
     """  
-    logging.debug("combination: %s" % repr(combination))
+    logging.debug("combination: %r", combination)
+    if repeat:
+        on_hotkey_repeat(state, combination, screen)
+        return
     if state.timeout is not None and time.time() > state.timeout:
-        logging.debug("combinations expired: %s" % repr(state.current_combination))
-        state.current_combination = []
-        logging.debug("start new combination")
-    state.current_combination.append(combination)
-    hotkeys = [(hotkey0, len(sequences) == len(state.current_combination)) 
-        for (hotkey0, sequences) in dcombinations.iteritems() 
-        if sequences[:len(state.current_combination)] == state.current_combination]
-    if len(hotkeys) > 1:
-        logging.debug("matching hotkeys: %s" % ", ".join(hk.name for (hk, f) in hotkeys))
+        logging.debug("combinations expired, start new combination")
+        reset_combination_state(state)
+    entry = state.node.get(combination)
+    if entry is None:
+        logging.debug("no combination found for: %r", combination)
+        reset_combination_state(state)
+        return
+    hotkey, children = entry
+    if children:
+        logging.debug("matching partial combination: %r", combination)
+        state.node = children
         state.timeout = time.time() + 2.0
-    elif len(hotkeys) == 1:
-        hotkey, finished = hotkeys[0]
-        if finished:
-            if hotkey.show_osd:
-                show_osd(hotkey.name, hotkey.command)
-            run_command(hotkey.command, directory=hotkey.directory)
-            state.current_combination = []
-            state.timeout = None
-        else:
-            logging.debug("matching partial hotkey: %s" % hotkey)
-            state.timeout = time.time() + 2.0
     else:
-        logging.debug("no combination found for sequence: %s" % state.current_combination)
-        state.current_combination = []
-        state.timeout = None
+        if state.latency:
+            state.latency.record("match", hotkey.name)
+        state.last_run = (combination, hotkey, time.time())
+        run_hotkey(state, hotkey, screen)
+        if state.latency:
+            state.latency.record("launch", hotkey.name)
+        reset_combination_state(state)
+
+def get_signal_number(name):
+    """Return the signal number for a name ("SIGUSR1", "USR1" or "10"), 
+    None if empty or not valid."""
+    name = name.strip().upper()
+    if not name:
+        return
+    if name.isdigit():
+        return int(name)
+    if not name.startswith("SIG"):
+        name = "SIG" + name
+    signum = getattr(signal, name, None)
+    if not isinstance(signum, int) or name.startswith("SIG_"):
+        logging.warning("unknown signal: %s", name)
+        return
+    return signum
+
+def check_instances(state, hotkey):
+    """Return True if a new process can be started for hotkey.
+
+    If single_instance is set (or max_instances is not 0) and the limit of 
+    running processes for the hotkey is reached, instance_signal (if set) 
+    is sent to them instead."""
+    if not state.supervisor:
+        return True
+    max_instances = (1 if hotkey.single_instance else hotkey.max_instances)
+    if max_instances <= 0:
+        return True
+    if state.supervisor.count_instances(hotkey.name) < max_instances:
+        return True
+    logging.info("hotkey %s: maximum instances running (%d)", 
+        hotkey.name, max_instances)
+    signum = get_signal_number(hotkey.instance_signal)
+    if signum is not None:
+        for child in state.supervisor.get_children(hotkey.name):
+            logging.info("sending signal %d to process %d", signum, child.pid)
+            try:
+                os.kill(child.pid, signum)
+            except OSError, details:
+                logging.warning("cannot send signal to process %d: %s", 
+                    child.pid, details)
+    return False
+
+def run_hotkey(state, hotkey, screen=0):
+    """Run the command of hotkey (showing the OSD if enabled) with the
+    environment of screen. Return None if the command was not started."""
+    if not check_instances(state, hotkey):
+        return
+    if hotkey.show_osd:
+        show_osd(hotkey.name, hotkey.command)
+    if hotkey in state.directories:
+        directory = state.directories[hotkey]
+    else:
+        directory = get_hotkey_directory(hotkey)
+    return launch_command(hotkey.command, directory=directory, 
+        launcher=state.launcher, supervisor=state.supervisor, name=hotkey.name,
+        environment=(state.environments and state.environments[screen]))
 
 def run_command(command, shell=True, directory=None, **popen_kwargs):
-    """Run command"""    
-    logging.debug("run_command: %s" % command)
-    if directory:
-        directory2 = os.path.expanduser(directory)
-        logging.info("setting current directory: %s" % directory2)
-        os.chdir(directory2)
+    """Run command (in directory, the daemon directory is not changed)"""    
+    import subprocess # lazy import, not needed until the first command is run
+    logging.debug("run_command: %s (directory: %s)", command, directory)
     try:
-        popen = subprocess.Popen(command, shell=shell, **popen_kwargs)
-        logging.info("process started with pid %s: %s" % (popen.pid, command))
+        popen = subprocess.Popen(command, shell=shell, cwd=directory, **popen_kwargs)
+        logging.info("process started with pid %s: %s", popen.pid, command)
     except OSError, details:
-        logging.error("error on subprocess.Popen: %s" % details)
+        logging.error("error on subprocess.Popen: %s", details)
     else:
         return popen
     
+def launch_command(command, directory=None, launcher=None, supervisor=None, 
+        name=None, environment=None):
+    """Run command through launcher (a fork server) if it's running or 
+    directly otherwise (with the variables in environment updated). Started
+    processes are registered in supervisor with the hotkey name."""
+    if isinstance(command, basestring) and not command.strip():
+        logging.error("empty command: %r", command)
+        return
+    if launcher and launcher.running():
+        try:
+            launch_id = launcher.launch(command, directory=directory, 
+                environment=environment)
+        except OSError, details:
+            logging.error("error on launcher, running command directly: %s", details)
+        else:
+            logging.info("launch %d requested: %s", launch_id, command)
+            if supervisor:
+                supervisor.add_launch(launch_id, name)
+            return launch_id
+    env = (dict(os.environ, **environment) if environment else None)
+    popen = run_command(command, directory=directory, env=env)
+    if popen and supervisor:
+        supervisor.add(popen.pid, name, popen)
+    return popen
+
+def on_launcher_responses(server, launcher, supervisor=None):
+    """Called when the launcher has responses to read."""
+    for response in launcher.read_responses():
+        if response[0] == "started":
+            launch_id, pid = response[1:]
+            logging.info("launch %d started with pid %s", launch_id, pid)
+            if supervisor:
+                supervisor.launch_started(launch_id, pid)
+        elif response[0] == "error":
+            launch_id, error = response[1:]
+            logging.error("launch %d failed: %s", launch_id, error)
+            if supervisor:
+                supervisor.launch_failed(launch_id)
+        elif response[0] == "exited":
+            pid, status = response[1:]
+            if supervisor:
+                supervisor.finish(pid, status)
+            else:
+                logging.info("process %d terminated (status %s)", pid, status)
+    if not launcher.running():
+        logging.error("launcher helper process has died")
+        server.remove_watch(launcher)
+        if supervisor:
+            supervisor.launcher_stopped()
+
 def set_signal_handlers(server):
     """Set signal handlers."""
     logging.debug("setting signal handlers")
@@ -164,52 +394,437 @@ def set_signal_handlers(server):
     signal.signal(signal.SIGTERM, terminate_callback)
     signal.signal(signal.SIGINT, terminate_callback)
 
-def configure_server(server, hotkeys):
-    """Configure xhotkeys server from config object."""
-    def get_combination_from_hotkey(hotkey):
-        logging.debug("configuring: %s (%s)" % (hotkey.name, hotkey.get_attributes()))
+def get_binding_combinations(binding, display=None):
+    """
+    Return the list of combinations (binding_type, mask, code) for a binding.
+    
+    >>> get_binding_combinations("<Control><Alt>t+Button1")
+    [('keyboard', 12, 28), ('mouse', 12, 1)]
+    """
+    smodifiers, string_keys = re.search("(<.*>)?(.*)$", binding).groups()
+    if smodifiers: 
+        modifiers = re.findall("<(.*?)>", smodifiers)
+    else: 
+        modifiers = []        
+    mask = sum(modifiers_masks[modifier.lower()] for modifier in modifiers)
+    combinations = []
+    for string_key in string_keys.split("+"):
+        match = re.match("button(\d+)$", string_key.lower())
+        if match:
+            combinations.append(("mouse", mask, int(match.group(1))))
+        elif string_key.startswith("#"):
+            combinations.append(("keyboard", mask, int(string_key[1:])))
+        else:
+            keycode = xhotkeys.get_keycode(string_key, display)
+            combinations.append(("keyboard", mask, keycode))
+    return combinations
+
+def compile_bindings(hotkeys, display=None):
+    """Return a dictionary {hotkey_name: combinations} for hotkeys."""
+    compiled = {}
+    for hotkey in hotkeys:
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("configuring: %s (%s)", hotkey.name, hotkey.get_attributes())
         if not hotkey.binding:
-            logging.warning("empty binding for hotkey: %s" % hotkey.name)
-            return        
-        smodifiers, string_keys = re.search("(<.*>)?(.*)$", hotkey.binding).groups()
-        combinations = []
-        for string_key in string_keys.split("+"):
-          match = re.match("button(\d+)$", string_key.lower())
-          if match:
-              binding_type = "mouse"
-              button = int(match.group(1))
-          else:
-              binding_type = "keyboard"
-              if string_key.startswith("#"):
-                  keycode = int(string_key[1:])
-              else:
-                  keycode = xhotkeys.get_keycode(string_key)
-          if smodifiers: 
-              modifiers = re.findall("<(.*?)>", smodifiers)
-          else: 
-              modifiers = []        
-          mask = sum(modifiers_masks[modifier.lower()] for modifier in modifiers)
-          if binding_type == "keyboard":
-            combination = (binding_type, mask, keycode)
-            combinations.append(combination)
-        return (hotkey, combinations)
-
-    dcombinations = dict(misc.compact(get_combination_from_hotkey(h) for h in hotkeys if h.active))
-    state = misc.Struct("combination-state", current_combination=[], timeout=None)
-    unique_combinations = misc.uniq(combination 
+            logging.warning("empty binding for hotkey: %s", hotkey.name)
+            continue
+        try:
+            compiled[hotkey.name] = get_binding_combinations(hotkey.binding, display)
+        except (AttributeError, KeyError, ValueError), details:
+            logging.error("invalid binding for hotkey %s: %s (%s)", 
+                hotkey.name, hotkey.binding, details)
+    return compiled
+
+def get_keymap_fingerprint(display):
+    """Return a fingerprint (string) of the keyboard mapping of display.
+    
+    The keymap kept by the display object (refreshed on MappingNotify 
+    events) is used, so no request is sent to the X server."""
+    info = display.display.info
+    keymap = [display.keycode_to_keysym(keycode, index)
+        for keycode in xrange(info.min_keycode, info.max_keycode + 1)
+        for index in xrange(KEYSYMS_PER_KEYCODE)]
+    data = repr((info.min_keycode, info.max_keycode, keymap))
+    return hashlib.sha1(data).hexdigest()
+
+def load_bindings_cache(cachefile):
+    """Return the bindings cache stored in cachefile (empty if not valid)."""
+    try:
+        fd = open(cachefile, "rb")
+        try:
+            cache = marshal.load(fd)
+        finally:
+            fd.close()
+    except (IOError, EOFError, ValueError, TypeError):
+        return {}
+    return (cache if isinstance(cache, dict) else {})
+
+def save_bindings_cache(cachefile, cache):
+    """Write bindings cache atomically to cachefile."""
+    tempfile = cachefile + ".tmp"
+    try:
+        fd = open(tempfile, "wb")
+        try:
+            marshal.dump(cache, fd)
+        finally:
+            fd.close()
+        os.rename(tempfile, cachefile)
+    except (IOError, OSError), details:
+        logging.warning("cannot write bindings cache %s: %s", cachefile, details)
+
+def get_compiled_bindings(hotkeys, display=None, cachefile=None):
+    """
+    Return a dictionary {hotkey_name: combinations} for hotkeys.
+    
+    If cachefile is given, compiled bindings are stored there keyed by the 
+    bindings and the keyboard mapping fingerprint, so an unchanged 
+    configuration and keymap are loaded without parsing bindings or 
+    resolving keycodes.
+    """
+    if not cachefile:
+        return compile_bindings(hotkeys, display)
+    if display is None:
+        display = xhotkeys.get_display()
+    bindings = sorted((hotkey.name, hotkey.binding) for hotkey in hotkeys)
+    key = hashlib.sha1(repr(bindings) + 
+        get_keymap_fingerprint(display)).hexdigest()
+    cache = load_bindings_cache(cachefile)
+    if key in cache:
+        logging.debug("compiled bindings loaded from cache: %s", cachefile)
+        timestamp, compiled = cache[key]
+        return compiled
+    compiled = compile_bindings(hotkeys, display)
+    oldest_keys = sorted(cache, key=lambda key0: cache[key0][0])
+    for key0 in oldest_keys[:max(0, len(cache) - BINDINGS_CACHE_SIZE + 1)]:
+        del cache[key0]
+    cache[key] = (time.time(), compiled)
+    save_bindings_cache(cachefile, cache)
+    return compiled
+    
+def configure_server(server, hotkeys, launcher=None, supervisor=None, 
+        cachefile=None, environments=None):
+    """Configure xhotkeys server from config object.
+    
+    Only the differences with the grabs currently active in the server are 
+    grabbed/ungrabbed, so this function is also used to reload the 
+    configuration. Commands are run through launcher if given (see 
+    xhotkeys.launcher) with the variables in environments (a dictionary 
+    for each screen of the server, see get_display_environment) updated, and 
+    registered in supervisor (see xhotkeys.supervisor). Compiled bindings 
+    are cached in cachefile (see get_compiled_bindings).
+    
+    Return the combination state used by the callbacks (the names of the
+    hotkeys that could not be grabbed are in its failed attribute)."""
+    active_hotkeys = [hotkey for hotkey in hotkeys if hotkey.active]
+    compiled = get_compiled_bindings(active_hotkeys, server.display, cachefile)
+    dcombinations = dict((hotkey, compiled[hotkey.name]) 
+        for hotkey in active_hotkeys if compiled.get(hotkey.name))
+    directories = dict((hotkey, get_hotkey_directory(hotkey)) 
+        for hotkey in dcombinations)
+    repeat_intervals = dict((hotkey, get_repeat_interval(hotkey)) 
+        for hotkey in dcombinations)
+    state = misc.Struct("combination-state", directories=directories,
+        launcher=launcher, supervisor=supervisor, latency=server.latency,
+        server=server, repeat_intervals=repeat_intervals, last_run=None,
+        trie=build_combinations_trie(dcombinations), node=None, timeout=None,
+        failed=set(), environments=environments)
+    reset_combination_state(state)
+    unique_combinations = list(misc.uniq(combination 
         for (hotkey, combinations) in dcombinations.iteritems() 
-        for combination in combinations)
+        for combination in combinations))
+    # Callbacks may run in executor threads, get the auto-repeat flag as an
+    # argument instead of reading server.repeat
+    server.pass_event_info = True
+    grabs = []
     for combination in unique_combinations:        
-        binding_type, mask, keycode = combination
-        callback = misc.partial_function(on_hotkey, state, dcombinations, combination)          
-        if binding_type == "keyboard":
-            logging.info("grabbing key: %s/%s" % (mask, keycode))
-            server.add_key_grab(keycode, mask, callback)
-        elif binding_type == "mouse":
-            logging.info("grabbing mouse button: %s/%s" % (mask, button))
-            server.add_button_grab(button, mask, callback)
+        binding_type, mask, code = combination
+        callback = misc.partial_function(on_hotkey, state, combination)
+        logging.info("grabbing %s: %s/%s", binding_type, mask, code)
+        grabs.append((event_types[binding_type], code, mask, callback, ()))
+    errors = server.set_grabs(grabs)
+    for combination, error in zip(unique_combinations, errors):
+        if error is not None:
+            names = [hotkey.name for (hotkey, combinations) 
+                in dcombinations.iteritems() if combination in combinations]
+            logging.error("cannot grab %s (hotkeys: %s): %s", 
+                combination, ", ".join(names), error)
+            state.failed.update(names)
+    return state
             
-def start_server(get_config_callback, ignore_mask=None):
+def on_keyboard_mapping_change(daemon, server):
+    """Called when the keyboard mapping of the display of server changes: 
+    resolve keycodes again and update the grabs whose keycode changed."""
+    logging.info("keyboard mapping changed on %s, updating grabs", 
+        server.display.get_display_name())
+    update_server(daemon, server)
+
+def get_servers(daemon):
+    """Return the servers of the daemon (one for each display)."""
+    return [daemon.server] + daemon.server.servers
+
+def get_display_environment(server, screen=0):
+    """Return the environment for the commands run from a screen of server."""
+    display_name = re.sub(r"\.\d+$", "", server.display.get_display_name())
+    return {"DISPLAY": "%s.%d" % (display_name, screen)}
+
+def configure_daemon_server(daemon, server):
+    """Configure a server of the daemon and return its state."""
+    if len(get_servers(daemon)) > 1 or len(server.roots) > 1:
+        environments = [get_display_environment(server, screen) 
+            for screen in range(len(server.roots))]
+    else:
+        environments = None
+    return configure_server(server, daemon.hotkeys, daemon.launcher,
+        daemon.supervisor, daemon.cachefile, environments)
+
+def update_server(daemon, server=None):
+    """Configure the daemon servers (only server if given) with its current 
+    hotkeys."""
+    if server is None:
+        daemon.states = [configure_daemon_server(daemon, server0) 
+            for server0 in get_servers(daemon)]
+    else:
+        daemon.states = [(configure_daemon_server(daemon, server) 
+            if state.server is server else state) for state in daemon.states]
+    daemon.state = daemon.states[0]
+
+def on_display_closed(server, daemon):
+    """Called when the connection to a secondary display is closed."""
+    logging.error("display %s closed, hotkeys not served there anymore", 
+        server.display.get_display_name())
+    daemon.states = [state for state in daemon.states if state.server is not server]
+
+def get_failed_hotkeys(daemon):
+    """Return the sorted names of the hotkeys that could not be grabbed (on
+    any display)."""
+    return sorted(set().union(*[state.failed for state in daemon.states]))
+
+def reload_configuration(daemon):
+    """Load the configuration and update the server. Return the names of the 
+    hotkeys that could not be grabbed."""
+    daemon.hotkeys = daemon.get_config_callback()
+    if daemon.configfile:
+        daemon.config_hash = get_file_hash(daemon.configfile)
+    update_server(daemon)
+    return get_failed_hotkeys(daemon)
+
+def find_hotkey(daemon, name):
+    """Return the hotkey with name (raise ControlError if not found)."""
+    from xhotkeys import control # lazy import, only used by the control socket
+    hotkey = misc.first(daemon.hotkeys, lambda hotkey: hotkey.name == name)
+    if hotkey is None:
+        raise control.ControlError("hotkey not found: %s" % name)
+    return hotkey
+
+def save_hotkey(daemon, hotkey, attributes):
+    """Update hotkey with attributes, save it to the configuration file and 
+    update the server grabs. Return True if the hotkey could be grabbed."""
+    from xhotkeys import control # lazy import, only used by the control socket
+    if not isinstance(attributes, dict):
+        raise control.ControlError("attributes must be an object: %r" % attributes)
+    unknown = [attr for attr in attributes 
+        if attr != hotkey.name_attribute and attr not in hotkey.attributes]
+    if unknown:
+        raise control.ControlError("unknown attributes: %s" % ", ".join(unknown))
+    value_types = {"string": basestring, "boolean": (bool, basestring), 
+        "integer": (int, basestring)}
+    for attr, value in attributes.iteritems():
+        options = hotkey.attributes.get(attr, dict(type="string"))
+        try:
+            if not isinstance(value, value_types[options["type"]]):
+                raise TypeError
+            convert_value(options, value)
+        except (TypeError, ValueError):
+            raise control.ControlError("invalid value for %s: %r" % (attr, value))
+    params = dict(hotkey.get_attributes(), name=hotkey.name)
+    params.update(attributes)
+    if not hotkey.valid(params):
+        raise control.ControlError("invalid hotkey: %s" % params)
+    old_params = dict(hotkey.get_attributes(), name=hotkey.name)
+    hotkey.update(attributes)
+    try:
+        hotkey.save()
+    except (IOError, OSError), details:
+        hotkey.update(old_params)
+        raise control.ControlError("cannot save hotkey: %s" % details)
+    if daemon.supervisor and hotkey.name != old_params["name"]:
+        daemon.supervisor.rename(old_params["name"], hotkey.name)
+    if daemon.configfile:
+        # The daemon wrote the file, do not reload it when the change is notified
+        daemon.config_hash = get_file_hash(daemon.configfile)
+    if hotkey not in daemon.hotkeys:
+        daemon.hotkeys.append(hotkey)
+    update_server(daemon)
+    return hotkey.name not in get_failed_hotkeys(daemon)
+
+def control_reload(daemon):
+    """Control command: reload the configuration file."""
+    logging.info("reloading configuration (control request)")
+    return {"failed": reload_configuration(daemon)}
+
+def control_add(daemon, name, attributes):
+    """Control command: add a new hotkey."""
+    from xhotkeys import control # lazy import, only used by the control socket
+    if misc.first(daemon.hotkeys, lambda hotkey: hotkey.name == name):
+        raise control.ControlError("hotkey already exists: %s" % name)
+    if not isinstance(attributes, dict):
+        raise control.ControlError("attributes must be an object: %r" % attributes)
+    hotkey = Hotkey(None, dict(name=""))
+    return {"grabbed": save_hotkey(daemon, hotkey, dict(attributes, name=name))}
+
+def control_update(daemon, name, attributes):
+    """Control command: update attributes of a hotkey (including its name)."""
+    hotkey = find_hotkey(daemon, name)
+    return {"grabbed": save_hotkey(daemon, hotkey, attributes)}
+
+def control_remove(daemon, name):
+    """Control command: remove a hotkey."""
+    hotkey = find_hotkey(daemon, name)
+    hotkey.delete()
+    if daemon.configfile:
+        daemon.config_hash = get_file_hash(daemon.configfile)
+    daemon.hotkeys.remove(hotkey)
+    update_server(daemon)
+    return True
+
+def control_trigger(daemon, name):
+    """Control command: run the command of a hotkey."""
+    from xhotkeys import control # lazy import, only used by the control socket
+    hotkey = find_hotkey(daemon, name)
+    if not run_hotkey(daemon.state, hotkey):
+        raise control.ControlError("command not started: %s" % hotkey.command)
+
+def control_grabs(daemon):
+    """Control command: return the active grabs (of all displays)."""
+    types = dict((value, key) for (key, value) in event_types.iteritems())
+    return [dict(type=types[event_type], code=code, modifiers=modifiers,
+            display=server.display.get_display_name())
+        for server in get_servers(daemon)
+        for (event_type, code, modifiers) in sorted(server.callbacks)]
+
+def control_status(daemon):
+    """Control command: return the status of the daemon."""
+    children = dict((name, [child.pid for child in children]) 
+        for (name, children) in daemon.supervisor.get_table().iteritems())
+    servers = get_servers(daemon)
+    return dict(pid=os.getpid(), version=VERSION, configfile=daemon.configfile,
+        hotkeys=[hotkey.name for hotkey in daemon.hotkeys],
+        failed=get_failed_hotkeys(daemon), children=children,
+        displays=[server.display.get_display_name() for server in servers],
+        grabs=sum(len(server.callbacks) for server in servers),
+        unknown_events=sum(sum(server.unknown_events.itervalues()) 
+            for server in servers))
+
+def control_latency(daemon):
+    """Control command: return latency percentiles (see xhotkeys.latency)."""
+    return daemon.server.latency.get_report()
+
+def control_log(daemon):
+    """Control command: return the recent log records (all levels)."""
+    from xhotkeys import control # lazy import, only used by the control socket
+    if not daemon.log_buffer:
+        raise control.ControlError("log buffer not enabled (see --log-buffer)")
+    return daemon.log_buffer.get_lines()
+
+def send_control_request(path, command, stream=None):
+    """Send a request to a running daemon and write the result (JSON) to 
+    stream. Return an exit code."""
+    import json
+    from xhotkeys import control # lazy import, only used by the control socket
+    if stream is None:
+        stream = sys.stdout
+    try:
+        result = control.send_request(path, command)
+    except (socket.error, control.ControlError), details:
+        logging.critical("request %s failed: %s", command, details)
+        return 1
+    stream.write(json.dumps(result, indent=2, sort_keys=True) + "\n")
+    return 0
+
+def start_control_server(daemon, path):
+    """Start listening for control requests on Unix socket path.
+
+    Return the control server (None if it could not be started)."""
+    from xhotkeys import control # lazy import, only used by the control socket
+    commands = {
+        "reload": control_reload,
+        "add": control_add,
+        "update": control_update,
+        "remove": control_remove,
+        "trigger": control_trigger,
+        "grabs": control_grabs,
+        "status": control_status,
+        "latency": control_latency,
+        "log": control_log,
+    }
+    handlers = dict((command, misc.partial_function(function, daemon))
+        for (command, function) in commands.iteritems())
+    control_server = control.ControlServer(path, handlers)
+    try:
+        control_server.start(daemon.server)
+    except socket.error, details:
+        logging.error("cannot start control server: %s", details)
+        return
+    return control_server
+            
+def get_file_hash(path):
+    """Return the MD5 digest of the contents of path (None if not readable)."""
+    try:
+        fd = open(path, "rb")
+        try:
+            return hashlib.md5(fd.read()).hexdigest()
+        finally:
+            fd.close()
+    except IOError:
+        return None
+
+def watch_config_file(daemon, configfile):
+    """Reload configuration when configfile changes.
+
+    The directory is watched (not the file) to catch editors that write a 
+    new file and rename it. Return True if the watch could be installed."""
+    from xhotkeys import inotify # lazy import, loads ctypes
+    try:
+        notifier = inotify.Inotify()
+        notifier.add_watch(os.path.dirname(configfile), 
+            inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO)
+    except OSError, details:
+        logging.warning("cannot watch configuration file: %s", details)
+        return False
+    daemon.config_hash = get_file_hash(configfile)
+    daemon.server.add_watch(notifier, on_config_directory_events, 
+        daemon, notifier, configfile)
+    logging.debug("watching configuration file: %s", configfile)
+    return True
+
+def on_config_directory_events(daemon, notifier, configfile):
+    """Called when there are inotify events on the configuration directory.
+    
+    Reloading is delayed until no events arrive for CONFIG_RELOAD_DELAY 
+    seconds, so a burst of writes results in a single reload."""
+    filename = os.path.basename(configfile)
+    names = [name for (wd, mask, cookie, name) in notifier.read_events()]
+    if filename not in names:
+        return
+    if daemon.reload_timeout is not None:
+        daemon.server.remove_timeout(daemon.reload_timeout)
+    daemon.reload_timeout = daemon.server.add_timeout(CONFIG_RELOAD_DELAY, 
+        on_config_file_changed, daemon, configfile)
+
+def on_config_file_changed(daemon, configfile):
+    """Reload configuration if the contents of configfile changed."""
+    daemon.reload_timeout = None
+    config_hash = get_file_hash(configfile)
+    if config_hash == daemon.config_hash:
+        logging.debug("configuration file not modified: %s", configfile)
+        return
+    daemon.config_hash = config_hash
+    logging.info("configuration file changed: %s", configfile)
+    raise XhotkeysServerReload
+
+def start_server(get_config_callback, ignore_mask=None, fork_server=True,
+        cachefile=None, configfile=None, control_socket=None, log_buffer=None,
+        displays=None):
     """
     Start a xhotkeys server linking key bindings to commands.
         
@@ -228,37 +843,100 @@ def start_server(get_config_callback, ignore_mask=None):
     }
     
     >>> start_server(lambda: config)
+    
+    If fork_server is True, commands are run from a helper process forked 
+    before connecting to the X server (see xhotkeys.launcher). Compiled 
+    bindings are cached in cachefile if given (see get_compiled_bindings).
+    If configfile is given, configuration is reloaded when it's modified.
+    If control_socket is given, the daemon listens there for control requests
+    (see xhotkeys.control), log_buffer (a misc.RingBufferHandler) is used to
+    return recent log records on request.
+    
+    displays is a list of X display names to serve (the default display if 
+    not given), hotkeys are grabbed on every screen of each display. All 
+    displays share the configuration and are dispatched from a single loop,
+    commands are run with DISPLAY set to the display and screen where the 
+    hotkey was pressed.
     """
+    import Xlib.display
+    from xhotkeys.launcher import ForkServerLauncher
+    from xhotkeys.latency import LatencyRecorder
     logging.info("starting xhotkeys server")
+    if fork_server:
+        launcher = ForkServerLauncher()
+        launcher.start()
+        logging.debug("launcher helper started with pid %d", launcher.pid)
+    else:
+        launcher = None
     if ignore_mask is None:
         ignore_mask = X.LockMask | X.Mod2Mask | X.Mod5Mask
-    logging.debug("ignore mask value: %s" % ignore_mask)
-    server = xhotkeys.XhotkeysServer(ignore_mask)
+    logging.debug("ignore mask value: %s", ignore_mask)
+    server = None
+    display_servers = []
+    latency = LatencyRecorder()
+    for display_name in (displays or [None]):
+        display = (Xlib.display.Display(display_name) if display_name else None)
+        display_server = xhotkeys.XhotkeysServer(ignore_mask, display=display)
+        display_server.latency = latency
+        display_servers.append(display_server)
+        logging.info("serving display %s (%d screens)", 
+            display_server.display.get_display_name(), len(display_server.roots))
+        if server is None:
+            server = display_server
+    supervisor = ChildSupervisor()
+    if launcher:
+        server.add_watch(launcher, on_launcher_responses, 
+            server, launcher, supervisor)
+    wakeup_fd = create_wakeup_fd()
+    server.add_watch(wakeup_fd, on_wakeup, wakeup_fd, supervisor)
+    daemon = misc.Struct("daemon", server=server, hotkeys=[], 
+        launcher=launcher, supervisor=supervisor, cachefile=cachefile,
+        get_config_callback=get_config_callback, configfile=configfile, 
+        state=None, states=[], config_hash=None, reload_timeout=None, 
+        log_buffer=log_buffer)
+    for display_server in display_servers:
+        display_server.add_mapping_callback(on_keyboard_mapping_change, 
+            daemon, display_server)
+        if display_server is not server:
+            server.add_server(display_server, on_display_closed, daemon)
+    if configfile:
+        watch_config_file(daemon, configfile)
+    control_server = (control_socket and 
+        start_control_server(daemon, control_socket))
     set_signal_handlers(server)
-    while 1:   
-        try:
-            config = get_config_callback()
-            configure_server(server, config)
-            server.run()
-            break
-        except XhotkeysServerReload:
-            logging.info("reloading configuration")
-            server.clear_grabs()
-
-def get_config(configfile):
-    """Load configfile and return a ConfigObj object."""
-    if isinstance(configfile, basestring) and not os.path.isfile(configfile):
-        logging.warning("configuration file not found: %s" % configfile)
-    logging.info("load configuration: %s" % configfile)
-    Hotkey.init(configfile)
+    try:
+        while 1:   
+            try:
+                reload_configuration(daemon)
+                server.run()
+                break
+            except XhotkeysServerReload:
+                logging.info("reloading configuration")
+    finally:
+        if control_server:
+            control_server.stop()
+
+def get_config(configfile, snapshot=False):
+    """Load configfile and return the list of hotkeys.
+    
+    If snapshot is True, hotkeys are loaded from a compiled snapshot next to 
+    configfile while it's up to date (see Hotkey.init)."""
+    snapshot_file = None
+    if isinstance(configfile, basestring):
+        if not os.path.isfile(configfile):
+            logging.warning("configuration file not found: %s", configfile)
+        if snapshot:
+            snapshot_file = configfile + CONFIG_SNAPSHOT_SUFFIX
+    logging.info("load configuration: %s", configfile)
+    Hotkey.init(configfile, snapshot_file)
     return Hotkey.items()
 
 def show_keyboard_info(ignore_mask, stream=None):
     """Show keyboard info (keys and available modifiers) to stream."""
     if stream is None:
         stream = sys.stdout
-    xk_keys = inspect.getmembers(Xlib.XK)
-    keys = [re.sub("^XK_", "", k) for (k, v) in xk_keys if re.match("^XK_", k)]
+    names, keysyms, lowercase_names = xhotkeys.get_keysyms_index()
+    keys = sorted(names)
     modifiers = ["ShiftMask", "LockMask", "ControlMask", "Mod1Mask", 
         "Mod2Mask", "Mod3Mask", "Mod4Mask", "Mod5Mask"]        
     modifiers2 = [name for (value, name) in modifiers_name.items() if value & ~ignore_mask]
@@ -268,6 +946,7 @@ def show_keyboard_info(ignore_mask, stream=None):
 def main(args):
     """Parse arguments and start a xhotkeys server reading a given 
     configuration file."""
+    from xhotkeys import control # lazy import, only used by the control socket
     usage = """usage: xhotkeyd [options]
         
     Bind keys and mouse combinations to commands for X-Windows"""
@@ -278,19 +957,49 @@ def main(args):
         metavar='FILE', type='string', help='Alternative configuration file')        
     parser.add_option('-i', '--key-info', dest='keyinfo', default=False, 
         action='store_true', help='Show keyboard info')                        
+    parser.add_option('-n', '--no-fork-server', dest='fork_server', default=True, 
+        action='store_false', help='Run commands directly from the daemon')
+    parser.add_option('-b', '--bindings-cache', dest='cachefile', 
+        default=BINDINGS_CACHE_FILE, metavar='FILE', type='string', 
+        help='Compiled bindings cache file (empty to disable)')
+    parser.add_option('-s', '--control-socket', dest='control_socket', 
+        default=control.CONTROL_SOCKET, metavar='FILE', type='string', 
+        help='Control socket path (empty to disable)')
+    parser.add_option('-r', '--request', dest='request', default=None, 
+        metavar='COMMAND', type='string', 
+        help='Send a request to the running daemon (status, grabs, latency, log, reload)')
+    parser.add_option('-l', '--log-buffer', dest='log_buffer', 
+        default=LOG_BUFFER_SIZE, metavar='N', type='int', 
+        help='Keep the last N log records in memory for the log request (0 to disable)')
+    parser.add_option('-d', '--display', dest='displays', default=None, 
+        metavar='DISPLAY', type='string', action='append',
+        help='X display to serve (can be repeated)')
+    parser.add_option('-N', '--no-config-snapshot', dest='config_snapshot', 
+        default=True, action='store_false', 
+        help='Do not keep a compiled snapshot of the configuration file')
     options, args = parser.parse_args(args)
     
     misc.verbose_level = options.verbose_level
-    ignore_mask = X.LockMask | X.Mod2Mask | X.Mod3Mask | X.Mod5Mask        
-    misc.set_verbose_level(options.verbose_level) 
+    ignore_mask = IGNORE_MASK
+    log_buffer = (misc.RingBufferHandler(options.log_buffer, logging.DEBUG) 
+        if options.log_buffer > 0 else None)
+    misc.set_verbose_level(options.verbose_level, log_buffer)
     
     if options.keyinfo:
         show_keyboard_info(ignore_mask)
         return    
-    # Get absolute path for the files as current directory is likely to change
+    if options.request:
+        return send_control_request(os.path.expanduser(options.control_socket), 
+            options.request)
+    # Get absolute path for the configuration file (it's shown on logs)
     configfile = os.path.abspath(os.path.expanduser(options.cfile or CONFIGURATION_FILE))
-    get_config_callback = misc.partial_function(get_config, configfile) 
-    return start_server(get_config_callback, ignore_mask)
+    get_config_callback = misc.partial_function(get_config, configfile, 
+        options.config_snapshot)
+    cachefile = options.cachefile and os.path.expanduser(options.cachefile)
+    control_socket = (options.control_socket and 
+        os.path.expanduser(options.control_socket))
+    return start_server(get_config_callback, ignore_mask, options.fork_server, 
+        cachefile, configfile, control_socket, log_buffer, options.displays)
         
 if __name__ == '__main__':
     sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,130 @@
+#!/usr/bin/python2
+"""
+Keep track of the processes launched by hotkeys.
+
+Children are reaped from the main loop (never from signal handlers) with
+a waitpid(-1, WNOHANG) loop, so coalesced SIGCHLD signals do not leave
+zombies behind. Processes run by a launcher helper (see xhotkeys.launcher)
+are registered with the pids and exit status it reports:
+
+>>> supervisor = ChildSupervisor()
+>>> supervisor.add(12345, "terminal")
+>>> supervisor.reap()
+>>> supervisor.get_children("terminal")
+[Struct child (hotkey='terminal', pid=12345, ...)]
+"""
+import os
+import time
+import errno
+import logging
+import collections
+
+from xhotkeys import misc
+
+def get_returncode(status):
+    """Return the returncode for a waitpid status (-signal if killed)."""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+class ChildSupervisor:
+    """Table of running (and recently finished) children for each hotkey."""
+
+    def __init__(self, history=100):
+        self.children = {}
+        self.finished = collections.deque(maxlen=history)
+        self.launches = {}
+
+    def add(self, pid, name, popen=None):
+        """Register a running child for hotkey name.
+
+        If the child was started with subprocess.Popen, pass the object so
+        it is updated when reaped instead of being polled by subprocess."""
+        child = misc.Struct("child", hotkey=name, pid=pid, popen=popen,
+            start_time=time.time(), end_time=None, returncode=None, runtime=None,
+            launched=False)
+        self.children[pid] = child
+        return child
+
+    def add_launch(self, launch_id, name):
+        """Register a launch request (see xhotkeys.launcher) for hotkey name."""
+        self.launches[launch_id] = name
+
+    def launch_started(self, launch_id, pid):
+        """Register the child started for a launch request."""
+        name = self.launches.pop(launch_id, None)
+        child = self.add(pid, name)
+        child.launched = True
+        return child
+
+    def launch_failed(self, launch_id):
+        """Forget a launch request that could not be executed."""
+        self.launches.pop(launch_id, None)
+
+    def launcher_stopped(self):
+        """Forget pending launch requests and the children run by the 
+        launcher helper when it stops (their end will not be reported)."""
+        self.launches.clear()
+        for child in self.children.values():
+            if child.launched:
+                del self.children[child.pid]
+
+    def rename(self, old_name, name):
+        """Move the children and launch requests of a renamed hotkey."""
+        for child in self.children.itervalues():
+            if child.hotkey == old_name:
+                child.hotkey = name
+        for launch_id, launch_name in self.launches.items():
+            if launch_name == old_name:
+                self.launches[launch_id] = name
+
+    def finish(self, pid, status):
+        """Register the end of a child from its waitpid status."""
+        child = self.children.pop(pid, None)
+        if child is None:
+            logging.debug("unknown process %d terminated", pid)
+            return
+        child.end_time = time.time()
+        child.returncode = get_returncode(status)
+        child.runtime = child.end_time - child.start_time
+        if child.popen:
+            child.popen.returncode = child.returncode
+            child.popen = None
+        self.finished.append(child)
+        logging.info("process %d (%s) terminated (return code %s, %.1f seconds)",
+            pid, child.hotkey, child.returncode, child.runtime)
+        return child
+
+    def reap(self):
+        """Reap all finished children of this process."""
+        while 1:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError, details:
+                if details.errno == errno.EINTR:
+                    continue
+                if details.errno != errno.ECHILD:
+                    raise
+                return
+            if not pid:
+                return
+            self.finish(pid, status)
+
+    def get_children(self, name=None):
+        """Return running children (only those for hotkey name if given)."""
+        return [child for child in self.children.itervalues()
+            if name is None or child.hotkey == name]
+
+    def count_instances(self, name):
+        """Return the number of running children and pending launches for 
+        hotkey name."""
+        return (len(self.get_children(name)) + 
+            sum(1 for launch_name in self.launches.itervalues() 
+                if launch_name == name))
+
+    def get_table(self):
+        """Return a dictionary {name: running children} for all hotkeys."""
+        table = {}
+        for child in self.children.itervalues():
+            table.setdefault(child.hotkey, []).append(child)
+        return table
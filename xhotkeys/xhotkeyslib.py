@@ -16,10 +16,14 @@ Listen to keyboard and mouse combinations and run callbacks. Example:
 >>> server.run() 
 """   
 import time
-import inspect
+import errno
+import heapq
+import select
+import socket
+import logging
 
 # Xlib modules
-import Xlib.display
+import Xlib.error
 import Xlib.XK
 import Xlib.X
 
@@ -36,28 +40,79 @@ MODIFIERS_MASK = [
     Xlib.X.Mod5Mask,
 ]
 
+# Index of keysym names (see get_keysyms_index)
+_keysyms_index = None
+
+def get_keysyms_index():
+    """Return a tuple of dictionaries (name -> keysym, keysym -> name, 
+    lowercase name -> keysym) for keysyms in Xlib.XK (built on first use)."""
+    global _keysyms_index
+    if _keysyms_index is None:
+        names = dict((name[len("XK_"):], keysym) 
+            for (name, keysym) in vars(Xlib.XK).iteritems() 
+            if name.startswith("XK_"))
+        keysyms = {}
+        lowercase_names = {}
+        for name in sorted(names):
+            keysyms[names[name]] = name
+            lowercase_names.setdefault(name.lower(), names[name])
+        _keysyms_index = (names, keysyms, lowercase_names)
+    return _keysyms_index
+
 def get_keysym(string):
-    """Return key-symbol from key-string: get_keysym("Cancel") -> Xlib.XK.XK_Cancel."""
-    return getattr(Xlib.XK, "XK_" + string)
+    """Return key-symbol from key-string: get_keysym("Cancel") -> Xlib.XK.XK_Cancel.
+    
+    If there is no key with that exact name, a case-insensitive match is 
+    tried: get_keysym("cancel") -> Xlib.XK.XK_Cancel."""
+    names, keysyms, lowercase_names = get_keysyms_index()
+    if string in names:
+        return names[string]
+    try:
+        return lowercase_names[string.lower()]
+    except KeyError:
+        raise AttributeError, "Unknown key: %s" % string
+
+# Shared connection to the X server (see get_display)
+_shared_display = None
+
+# Resolved keycodes for each display: {display: {keysym: keycode}}
+_keycodes_cache = {}
+
+def get_display():
+    """Return a module-level connection to the X server (opened on first use)."""
+    global _shared_display
+    if _shared_display is None:
+        import Xlib.display # lazy import, not needed with a given display
+        _shared_display = Xlib.display.Display()
+    return _shared_display
+
+def clear_keycodes_cache(display=None):
+    """Clear resolved keycodes for display (all displays if None)."""
+    if display is None:
+        _keycodes_cache.clear()
+    else:
+        _keycodes_cache.pop(display, None)
 
 def get_keycode(string, display=None):
     """Return keycode from from key string."""
     if display is None:
-        display = Xlib.display.Display()
-    return display.keysym_to_keycode(get_keysym(string))
+        display = get_display()
+    keysym = get_keysym(string)
+    cache = _keycodes_cache.setdefault(display, {})
+    if keysym not in cache:
+        cache[keysym] = display.keysym_to_keycode(keysym)
+    return cache[keysym]
 
 def keycode_to_keysym(keycode, index=0, display=None):
     """Return keysym from keycode"""
     if display is None:
-        display = Xlib.display.Display()
+        display = get_display()
     return display.keycode_to_keysym(keycode, index)
 
 def get_keysym_to_string_mapping(display=None):
-    """Return pairs (keysym, string)."""
-    if display is None:
-        display = Xlib.display.Display()
-    return dict((keysym, name[len("XK_"):]) for (name, keysym) 
-        in inspect.getmembers(Xlib.XK) if name.startswith("XK_"))
+    """Return pairs (keysym, string). The dictionary is shared, do not modify it."""
+    names, keysyms, lowercase_names = get_keysyms_index()
+    return keysyms
     
 def get_mask_combinations(mask):
     """Get all combinations for a mask"""
@@ -69,29 +124,50 @@ def ungrab(display, root):
     root.ungrab_key(Xlib.X.AnyKey, Xlib.X.AnyModifier)
     root.ungrab_button(Xlib.X.AnyButton, Xlib.X.AnyModifier)
             
-def grab_key(display, root, keycode, modifiers, ignore_masks):
+def grab_key(display, root, keycode, modifiers, ignore_masks, onerror=None):
     """Grab a key symbol (with an optional modifier)"""
     def _grab(mode):
         for mask in ignore_masks:
             mod = modifiers | mask
-            root.grab_key(keycode, mod, 0, mode, mode)
+            root.grab_key(keycode, mod, 0, mode, mode, onerror=onerror)
             yield (keycode, mod)
     return list(_grab(mode=Xlib.X.GrabModeAsync))
 
-def grab_button(display, root, button, modifiers, ignore_masks):
+def grab_button(display, root, button, modifiers, ignore_masks, onerror=None):
     """Grab a key symbol (with an optional modifier)"""
     def _grab(button, mode):
         for mask in ignore_masks:
             mod = modifiers | mask
             root.grab_button(button, mod, root, Xlib.X.ButtonPressMask, 
-                mode, mode, 0, 0)
+                mode, mode, 0, 0, onerror=onerror)
             yield (button, mod)
     return list(_grab(button=button, mode=Xlib.X.GrabModeAsync))
 
+def ungrab_key(display, root, keycode, modifiers, ignore_masks):
+    """Ungrab a key grabbed with grab_key"""
+    for mask in ignore_masks:
+        root.ungrab_key(keycode, modifiers | mask)
+
+def ungrab_button(display, root, button, modifiers, ignore_masks):
+    """Ungrab a button grabbed with grab_button"""
+    for mask in ignore_masks:
+        root.ungrab_button(button, modifiers | mask)
+
+def wait_for_input(objects, timeout=None):
+    """Block until any of objects (file descriptors or objects with a fileno 
+    method) is ready for reading or timeout (in seconds) expires. Return 
+    the list of ready objects (empty if interrupted by a signal)."""
+    try:
+        return select.select(objects, [], [], timeout)[0]
+    except select.error, details:
+        if details.args[0] != errno.EINTR:
+            raise
+        return []
+
 def get_keycode_to_modifier_mask_mapping(modifiers=None, display=None):
     """Return a dictionary of pairs (keycode, modifier_mask)."""
     if display is None:
-        display = Xlib.display.Display()
+        display = get_display()
     mapping = {}
     for keycodes, mask in zip(display.get_modifier_mapping(), MODIFIERS_MASK):
         if modifiers is not None and mask not in modifiers:
@@ -104,6 +180,13 @@ def get_keycode_to_modifier_mask_mapping(modifiers=None, display=None):
                     mapping[keycode2] = mask
     return mapping
             
+def pack_combination(event_type, code, modifiers):
+    """Return a combination packed in an integer (used as dispatch key).
+    
+    Codes (keycodes and buttons) are 8-bit values and modifiers (the state
+    of an event) 16-bit values."""
+    return (event_type << 24) | (modifiers << 8) | code
+
 class XhotkeysServer:
     """
     Listen to keyboard and mouse hotkeys and run callbacks.
@@ -125,57 +208,331 @@ class XhotkeysServer:
     >>> server.add_key_grab(Xlib.XK.XK_1, Xlib.X.ControlMask, callback, "some arg") 
     >>> server.add_button_grab(1, Xlib.X.ControlMask | Xlib.X.Mod1Mask, callback)
     >>> server.run() 
+    
+    If no display is given, the connection shared by the module functions 
+    (see get_display) is used. Grabs are set on the root window of every
+    screen of the display unless a root is given. Servers on other displays
+    can be dispatched from the same loop (see add_server). 
+    
+    Callbacks are run in the event loop unless an executor is set (see 
+    xhotkeys.executor); in that case the repeat attribute is not meaningful
+    for them, set pass_event_info to get the auto-repeat flag and the screen
+    of the event as their last arguments instead. Change callbacks only through the grab methods, events
+    are dispatched from a table built from them.
     """
 
     accepted_event_types = [Xlib.X.KeyPress, Xlib.X.ButtonPress]
+    dispatch_event_types = frozenset(accepted_event_types)
+    
+    grab_functions = {
+        Xlib.X.KeyPress: (grab_key, ungrab_key),
+        Xlib.X.ButtonPress: (grab_button, ungrab_button),
+    }
 
     def _add_callback(self, event_type, code, modifiers, cbfun, cbargs):
         """Add a callback to callbacks dictionary."""
         key = (event_type, code, modifiers)
         self.callbacks[key] = (cbfun, cbargs)
+        self.dispatch_table = None
+
+    def _ungrab(self, event_type, code, modifiers):
+        """Ungrab a combination on all roots."""
+        grab_function, ungrab_function = self.grab_functions[event_type]
+        for root in self.roots:
+            ungrab_function(self.display, root, code, modifiers, 
+                self.ignore_masks)
 
     # Public interface
     
     def __init__(self, ignore_mask, display=None, root=None):
         """Init xhotkeys server and callbacks data"""
-        self.display = display or Xlib.display.Display()
-        self.root = root or self.display.screen().root
+        self.display = display or get_display()
+        if root:
+            self.roots = [root]
+        else:
+            self.roots = [self.display.screen(index).root 
+                for index in range(self.display.screen_count())]
+        self.root = self.roots[0]
+        # Screen number (index in roots) of each root window
+        self.screens = dict((root, index) 
+            for (index, root) in enumerate(self.roots))
         self.ignore_mask = ignore_mask
         self.ignore_masks = get_mask_combinations(ignore_mask)
         self.callbacks = {}
+        # Callbacks by packed combination, built on demand (see dispatch_event)
+        self.dispatch_table = None
+        self.watches = {}
+        self.mapping_callbacks = []
+        self.keyboard_mapping_changed = False
+        self.timeouts = []
+        self.last_timeout_id = 0
+        # Latency recorder (see xhotkeys.latency), disabled if None
+        self.latency = None
+        # Events received with no callback: {(type, code, modifiers): count}
+        self.unknown_events = {}
+        # Executor for callbacks (see xhotkeys.executor), run inline if None
+        self.executor = None
+        # True while running the callback of an auto-repeated key press
+        self.repeat = False
+        # If True, the repeat flag and the screen number of the event are 
+        # appended to the arguments of callbacks
+        self.pass_event_info = False
+        self.last_key_release = None
+        # Servers on other displays dispatched from this one (see add_server)
+        self.servers = []
+        self.closed_callbacks = {}
     
     def add_key_grab(self, keycode, modifiers, callback, *args):
         """Add a keyboard grab to server. Look Xlib.X for key symbols"""        
-        grab_key(self.display, self.root, keycode, modifiers, self.ignore_masks)
+        for root in self.roots:
+            grab_key(self.display, root, keycode, modifiers, self.ignore_masks)
         self._add_callback(Xlib.X.KeyPress, keycode, modifiers, callback, args)
 
     def add_button_grab(self, button, modifiers, callback, *args):
         """Add a button (normally, a mouse button) grab to server"""
-        grab_button(self.display, self.root, button, modifiers, self.ignore_masks)
+        for root in self.roots:
+            grab_button(self.display, root, button, modifiers, self.ignore_masks)
         self._add_callback(Xlib.X.ButtonPress, button, modifiers, callback, args)
                         
+    def add_grabs(self, grabs):
+        """Add a list of grabs checking errors with a single round-trip.
+        
+        grabs is a list of tuples (event_type, code, modifiers, callback, args),
+        where event_type is Xlib.X.KeyPress (code is a keycode) or 
+        Xlib.X.ButtonPress (code is a button). All requests are queued and 
+        the connection synced once. Return a list with the X error for each
+        grab (None if it succeeded). Callbacks are added only for successful
+        grabs, the rest are ungrabbed (another client may hold them)."""
+        errors = [None] * len(grabs)
+        def _onerror(error, request, index):
+            if errors[index] is None:
+                errors[index] = error
+        for index, (event_type, code, modifiers, cbfun, cbargs) in enumerate(grabs):
+            grab_function, ungrab_function = self.grab_functions[event_type]
+            onerror = misc.partial_function(_onerror, index=index)
+            for root in self.roots:
+                grab_function(self.display, root, code, modifiers, 
+                    self.ignore_masks, onerror=onerror)
+        self.display.sync()
+        for error, grab in zip(errors, grabs):
+            event_type, code, modifiers, cbfun, cbargs = grab
+            if error is None:
+                self._add_callback(event_type, code, modifiers, cbfun, cbargs)
+            else:
+                self._ungrab(event_type, code, modifiers)
+        return errors
+        
+    def set_grabs(self, grabs):
+        """Make grabs the set of active grabs touching only the differences.
+        
+        grabs has the same format as in add_grabs. Active grabs not in the 
+        list are ungrabbed, new ones are added with add_grabs and callbacks 
+        of grabs kept are replaced in place. Return a list with the X error 
+        for each grab (None if it succeeded or was already active)."""
+        def _key(grab):
+            return grab[:3]
+        new_keys = set(_key(grab) for grab in grabs)
+        for key in self.callbacks.keys():
+            if key not in new_keys:
+                self._ungrab(*key)
+                del self.callbacks[key]
+                self.dispatch_table = None
+        new_grabs = []
+        for grab in grabs:
+            event_type, code, modifiers, cbfun, cbargs = grab
+            if _key(grab) in self.callbacks:
+                self._add_callback(event_type, code, modifiers, cbfun, cbargs)
+            else:
+                new_grabs.append(grab)
+        if not new_grabs:
+            self.display.flush()
+            return [None] * len(grabs)
+        new_errors = dict(zip(map(_key, new_grabs), self.add_grabs(new_grabs)))
+        return [new_errors.get(_key(grab)) for grab in grabs]
+        
     def clear_grabs(self):
         """Clear all grabs and its callbacks"""
-        ungrab(self.display, self.root)
+        for root in self.roots:
+            ungrab(self.display, root)
         self.callbacks.clear()
+        self.dispatch_table = None
         
-    def run(self, looptime=0.1):        
-        """Run the server calling the configured callbacks on events"""
+    def add_server(self, server, closed_callback=None, *args):
+        """Dispatch events and timeouts of server (usually connected to
+        another display) from the loop of this server (see run). Watches 
+        of server are not used, add them to this server. 
+        
+        When the connection of server is closed, it's removed and
+        closed_callback(server, *args) is run (if given)."""
+        self.servers.append(server)
+        self.closed_callbacks[server] = (closed_callback, args)
+
+    def remove_server(self, server):
+        """Remove a server added with add_server."""
+        if server in self.servers:
+            self.servers.remove(server)
+        self.closed_callbacks.pop(server, None)
+
+    def on_server_closed(self, server, details):
+        """Called when the connection of a server added with add_server was 
+        closed."""
+        logging.warning("connection closed: %s (%s)", 
+            server.display.get_display_name(), details)
+        callback, args = self.closed_callbacks.get(server, (None, ()))
+        self.remove_server(server)
+        if callback:
+            callback(server, *args)
+        
+    def add_watch(self, fd, callback, *args):
+        """Run callback(*args) when fd (a file descriptor or an object with a
+        fileno method) is ready for reading while the server is running."""
+        self.watches[fd] = (callback, args)
+
+    def remove_watch(self, fd):
+        """Remove a watch added with add_watch."""
+        self.watches.pop(fd, None)
+        
+    def add_timeout(self, delay, callback, *args):
+        """Run callback(*args) once after delay seconds while the server is
+        running. Return an identifier to be used with remove_timeout."""
+        self.last_timeout_id += 1
+        heapq.heappush(self.timeouts, 
+            (time.time() + delay, self.last_timeout_id, callback, args))
+        return self.last_timeout_id
+
+    def remove_timeout(self, timeout_id):
+        """Remove a timeout added with add_timeout (if not run yet)."""
+        self.timeouts = [timeout for timeout in self.timeouts 
+            if timeout[1] != timeout_id]
+        heapq.heapify(self.timeouts)
+
+    def run_timeouts(self):
+        """Run expired timeouts and return the time (in seconds) until the 
+        next one (None if there are no timeouts left)."""
+        while self.timeouts and self.timeouts[0][0] <= time.time():
+            deadline, timeout_id, callback, args = heapq.heappop(self.timeouts)
+            callback(*args)
+        if self.timeouts:
+            return max(0.0, self.timeouts[0][0] - time.time())
+        
+    def add_mapping_callback(self, callback, *args):
+        """Run callback(*args) when the keyboard mapping changes.
+        
+        Keycodes of grabs may have changed, callbacks should resolve them 
+        again and update grabs (set_grabs touches only the differences).
+        A burst of MappingNotify events runs callbacks only once."""
+        self.mapping_callbacks.append((callback, args))
+        
+    def on_mapping_notify(self, event):
+        """Refresh the keyboard mapping and forget resolved keycodes."""
+        self.display.refresh_keyboard_mapping(event)
+        if event.request == Xlib.X.MappingKeyboard:
+            clear_keycodes_cache(self.display)
+            self.keyboard_mapping_changed = True
+
+    def build_dispatch_table(self):
+        """Build the dispatch table from callbacks and return it.
+        
+        The table is a dictionary {packed_combination: (callback, args)} (see 
+        pack_combination), so events are matched with a single lookup. It's
+        rebuilt on the first event after the grabs change."""
+        self.dispatch_table = dict((pack_combination(*key), value)
+            for (key, value) in self.callbacks.iteritems())
+        return self.dispatch_table
+
+    def _dispatch_other_event(self, event):
+        """Process an event that is neither a key nor a button press."""
+        event_type = event.type
+        if event_type == Xlib.X.MappingNotify:
+            self.on_mapping_notify(event)
+        elif event_type == Xlib.X.KeyRelease:
+            self.last_key_release = (event.detail, event.time)
+
+    def dispatch_event(self, event):
+        """Run the callback configured for an event (if any)."""
+        event_type = event.type
+        if event_type not in self.dispatch_event_types:
+            self._dispatch_other_event(event)
+            return
+        detail = event.detail
+        # X auto-repeat sends a release/press pair with the same timestamp
+        if self.last_key_release is None:
+            self.repeat = False
+        else:
+            self.repeat = (event_type == Xlib.X.KeyPress and 
+                self.last_key_release == (detail, event.time))
+            self.last_key_release = None
+        mask = event.state & ~self.ignore_mask
+        table = self.dispatch_table
+        if table is None:
+            table = self.build_dispatch_table()
+        # Inlined pack_combination(event_type, detail, mask)
+        entry = table.get((event_type << 24) | (mask << 8) | detail)
+        if entry is None:
+            key = (event_type, detail, mask)
+            self.unknown_events[key] = self.unknown_events.get(key, 0) + 1
+            if logging.root.isEnabledFor(logging.DEBUG):
+                logging.debug("undefined event received: %r", key)
+            return
+        if self.latency is not None:
+            self.latency.start_event(getattr(event, "time", None))
+        callback, args = entry
+        if self.pass_event_info:
+            args = args + (self.repeat, self.screens.get(event.root, 0))
+        if self.executor is None:
+            callback(*args)
+        else:
+            self.executor.submit(callback, args)
+
+    def process_pending_events(self):
+        """Dispatch all queued events without blocking and run mapping 
+        callbacks if the keyboard mapping changed. Return the number of 
+        events processed (None if the connection was closed)."""
+        pending_events = self.display.pending_events()
+        if not pending_events:
+            return pending_events
+        for index in xrange(pending_events):
+            self.dispatch_event(self.display.next_event())
+        if self.keyboard_mapping_changed:
+            self.keyboard_mapping_changed = False
+            for callback, args in self.mapping_callbacks:
+                callback(*args)
+        return pending_events
+        
+    def run(self, looptime=None):        
+        """Run the server calling the configured callbacks on events.
+        
+        The server sleeps on the X connection (and watched descriptors, see
+        add_watch) until some event arrives or a timeout expires (see 
+        add_timeout), then dispatches all queued events. Servers added with 
+        add_server are dispatched from the same loop, they are removed when
+        their connection is closed (the loop ends when it's the connection
+        of this server). looptime is only kept for backwards compatibility: 
+        if given, it's the maximum time (in seconds) to wait before checking 
+        the connection again."""
         while 1:
-            pending_events = self.display.pending_events()
+            timeouts = [server.run_timeouts() for server in [self] + self.servers]
+            timeouts = [timeout for timeout in timeouts if timeout is not None]
+            timeout = (min(timeouts) if timeouts else None)
+            pending_events = self.process_pending_events()
             if pending_events is None:
                 break
-            elif not pending_events:
-                time.sleep(looptime)
-                continue
-            event = self.display.next_event()
-            if (not hasattr(event, "type") or 
-                    event.type not in self.accepted_event_types): 
-                continue
-            mask = event.state & ~self.ignore_mask
-            key = (event.type, event.detail, mask)
-            if key not in self.callbacks:
-                print("warning: undefined event received: %s" % list(key))
-                continue
-            callback, args = self.callbacks[key]
-            callback(*args)
+            for server in list(self.servers):
+                try:
+                    server_events = server.process_pending_events()
+                except (Xlib.error.ConnectionClosedError, socket.error), details:
+                    self.on_server_closed(server, details)
+                    continue
+                if server_events is None:
+                    self.on_server_closed(server, "end of connection")
+                else:
+                    pending_events += server_events
+            if not pending_events:
+                if looptime is not None:
+                    timeout = (looptime if timeout is None else min(timeout, looptime))
+                fds = ([self.display] + [server.display for server in self.servers] +
+                    self.watches.keys())
+                for fd in wait_for_input(fds, timeout):
+                    if fd in self.watches:
+                        callback, args = self.watches[fd]
+                        callback(*args)